@@ -0,0 +1,15 @@
+"""
+Vercel serverless entry point.
+
+Vercel's Python runtime serves ASGI apps directly, so every route is handled
+by the FastAPI app in main.py (routing, CORS and JSON encoding included)
+instead of per-endpoint http.server handlers.
+"""
+
+import os
+import sys
+
+# Make the backend modules importable when Vercel loads this file from api/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app  # noqa: E402
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class PromptBatcher:
+    """
+    Coalesces prompts that arrive close together into a single inference call.
+
+    Callers `submit` one model input and await its completion. A background
+    task collects up to `max_batch_size` inputs, waiting at most `max_wait_ms`
+    after the first one arrives, sends them in one call and resolves each
+    caller's future with its own result. `send_batch` may return an exception
+    in place of a result to fail only that caller.
+    """
+
+    def __init__(
+        self,
+        send_batch: Callable[[List[bytes]], Awaitable[List[Union[str, BaseException]]]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 25,
+    ):
+        """
+        Args:
+            send_batch: Coroutine function mapping a list of encoded inputs to a
+                list of completions (or exceptions) in the same order
+            max_batch_size (int): Maximum number of inputs sent in one call
+            max_wait_ms (float): How long to hold a batch open for more inputs
+        """
+        self._send_batch = send_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Dispatches in flight; the event loop only keeps weak references to tasks
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def submit(self, inputs: bytes) -> str:
+        """
+        Queue one model input and wait for its completion.
+
+        Args:
+            inputs (bytes): Fully formatted model input, already JSON-encoded
+
+        Returns:
+            str: Generated text for this input
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            # The queue and worker are bound to the loop they were created on
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        await self._queue.put((inputs, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without blocking collection of the next batch
+            task = loop.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[bytes, asyncio.Future]]) -> None:
+        logger.debug("Dispatching batch of %d prompt(s)", len(batch))
+        try:
+            results = await self._send_batch([inputs for inputs, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Expected {len(batch)} completions, got {len(results)}")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
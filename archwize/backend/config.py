@@ -1,28 +1,75 @@
+import logging
 import os
+import tempfile
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+# Load environment variables from .env file. This module is the only place
+# that reads it; the marker lets worker processes, which inherit the parent's
+# environment, skip parsing it again.
+if not os.getenv("ARCHWIZE_DOTENV_LOADED"):
+    load_dotenv()
+    os.environ["ARCHWIZE_DOTENV_LOADED"] = "1"
 
 # API Keys (Required for Hugging Face Inference API)
 HUGGINGFACE_API_TOKEN = os.getenv("HUGGINGFACE_API_TOKEN")  # Required for authentication
 
+# Inference endpoint (Hugging Face hosted Mistral by default). Point this at a
+# self-hosted text-generation-inference (TGI) server to use a local model; other
+# servers such as vLLM use a different request and stream format.
+DEFAULT_INFERENCE_API_URL = "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.2"
+INFERENCE_API_URL = os.getenv("INFERENCE_API_URL", DEFAULT_INFERENCE_API_URL)
+
+# Inference API limits: concurrent calls per worker, and calls per minute per worker (0 = unlimited)
+HF_MAX_INFLIGHT = int(os.getenv("HF_MAX_INFLIGHT", "16"))
+HF_RATE_LIMIT_PER_MINUTE = int(os.getenv("HF_RATE_LIMIT_PER_MINUTE", "60"))
+
 # Application Settings
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if DEBUG else "INFO").upper()  # WARNING keeps per-request logs off in production
+# Optional log file (strftime codes are expanded, e.g. api_%Y%m%d.log); empty logs to the console only,
+# which suits read-only filesystems such as Vercel's
+LOG_FILE = os.getenv("LOG_FILE", "")
 PORT = int(os.getenv("PORT", "8000"))
 HOST = os.getenv("HOST", "0.0.0.0")
+# Worker processes for `python main.py`. Each loads its own caches: about 60 MB per worker,
+# or roughly 600 MB with the semantic cache (torch and the embedding model)
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
 
 # CORS Settings
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
 
+# Warm the embedding model, parser and inference connection before the first request
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "True").lower() == "true"
+
+# Persistent Diagram Cache Settings (survives restarts, shared by workers; empty dir disables it)
+DIAGRAM_CACHE_DIR = os.getenv("DIAGRAM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "archwize", "diagrams"))
+DIAGRAM_CACHE_SIZE_MB = int(os.getenv("DIAGRAM_CACHE_SIZE_MB", "256"))
+DIAGRAM_CACHE_TTL = int(os.getenv("DIAGRAM_CACHE_TTL", "86400"))  # Seconds, for memory and disk entries
+DIAGRAM_CACHE_MAXSIZE = int(os.getenv("DIAGRAM_CACHE_MAXSIZE", "1024"))  # In-memory entries per worker
+
+# Semantic Cache Settings
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "True").lower() == "true"
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.87"))
+SEMANTIC_CACHE_TOP_K = int(os.getenv("SEMANTIC_CACHE_TOP_K", "1"))
+SEMANTIC_CACHE_MAXSIZE = int(os.getenv("SEMANTIC_CACHE_MAXSIZE", "1024"))  # Prompts per orientation; oldest evicted first
+
+# Request Batching Settings (prompts arriving within the wait window share one API call).
+# Off by default: text-generation-inference, which serves the hosted models, only
+# accepts a single string input. Raise it for endpoints that take a list of inputs.
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "1"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "25"))
+
 # Verify required environment variables
 def verify_env_vars():
     required_vars = ["HUGGINGFACE_API_TOKEN"]
     missing_vars = [var for var in required_vars if not os.getenv(var)]
     
     if missing_vars:
-        print(f"Warning: Missing required environment variables: {', '.join(missing_vars)}")
-        print("Some functionality may not work properly.")
+        logging.getLogger(__name__).warning(
+            "Missing required environment variables: %s. Some functionality may not work properly.",
+            ", ".join(missing_vars),
+        )
         return False
     
     return True 
\ No newline at end of file
@@ -1,27 +1,56 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-import os
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import atexit
 import logging
+import queue
+import orjson
+from contextlib import asynccontextmanager
 from datetime import datetime
 from enum import Enum
-from dotenv import load_dotenv
+from logging.handlers import QueueHandler, QueueListener
 from pydantic import BaseModel, Field
+from config import HOST, LOG_FILE, LOG_LEVEL, PORT, WARMUP_ON_STARTUP, WORKERS, verify_env_vars
 from services import DiagramService
 
-# Configure logging
+# Configure logging. Request handlers only enqueue records; a background
+# listener thread does the file and console writes off the event loop.
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [logging.StreamHandler()]
+if LOG_FILE:
+    _log_handlers.append(logging.FileHandler(datetime.now().strftime(LOG_FILE)))
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+# The queue handler only renders the message (and any traceback); the listener's handlers add the prefix
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
 logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f"api_{datetime.now().strftime('%Y%m%d')}.log"),
-        logging.StreamHandler()
-    ]
+    level=LOG_LEVEL,
+    handlers=[_queue_handler]
 )
 logger = logging.getLogger("archwize_api")
 
-load_dotenv()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    verify_env_vars()
+    await DiagramService.startup()
+    if WARMUP_ON_STARTUP:
+        logger.info("Warming up inference API connection")
+        await DiagramService.warmup()
+    yield
+    await DiagramService.aclose()
 
-app = FastAPI(title="ArchWize API", description="AI-Powered Diagram & Architecture Flowchart Generator")
+# Serialize responses with orjson rather than the standard library encoder
+app = FastAPI(
+    title="ArchWize API",
+    description="AI-Powered Diagram & Architecture Flowchart Generator",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # Configure CORS
 app.add_middleware(
@@ -57,7 +86,7 @@ def home():
 
 @app.post("/generate")
 async def generate_diagram(request: DiagramRequest):
-    logger.info(f"Received diagram generation request: {request.prompt} with orientation: {request.orientation}")
+    logger.info("Received diagram generation request: %s with orientation: %s", request.prompt, request.orientation.value)
     try:
         # Use the DiagramService to generate the diagram with the specified orientation
         mermaid_code = await DiagramService.generate_mermaid_diagram(request.prompt, request.orientation)
@@ -66,15 +95,44 @@ async def generate_diagram(request: DiagramRequest):
     except ValueError as e:
         # Specific handling for validation errors
         error_message = str(e)
-        logger.error(f"Validation error: {error_message}")
+        logger.error("Validation error: %s", error_message)
         return ErrorResponse(error="validation_error", message=error_message)
     except Exception as e:
         # General error handling
-        error_message = f"Unexpected error: {str(e)}"
-        logger.error(error_message, exc_info=True)
+        logger.exception("Unexpected error: %s", e)
         return ErrorResponse(error="server_error", message="An unexpected error occurred while generating the diagram")
 
+@app.post("/generate/stream")
+async def generate_diagram_stream(request: DiagramRequest):
+    """
+    Stream diagram generation as newline-delimited JSON.
+    
+    Each line is {"token": ...} for a fragment of model output as it is
+    generated. The last line has the same shape as the /generate response.
+    """
+    logger.info("Received streaming diagram request: %s with orientation: %s", request.prompt, request.orientation.value)
+    
+    async def events():
+        try:
+            async for event in DiagramService.stream_mermaid_diagram(request.prompt, request.orientation):
+                if "mermaid_code" in event:
+                    logger.info("Diagram generation successful")
+                    event = DiagramResponse(mermaid_code=event["mermaid_code"]).model_dump()
+                yield orjson.dumps(event) + b"\n"
+        except ValueError as e:
+            error_message = str(e)
+            logger.error("Validation error: %s", error_message)
+            yield orjson.dumps(ErrorResponse(error="validation_error", message=error_message).model_dump()) + b"\n"
+        except Exception as e:
+            logger.exception("Unexpected error: %s", e)
+            yield orjson.dumps(ErrorResponse(error="server_error", message="An unexpected error occurred while generating the diagram").model_dump()) + b"\n"
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
 if __name__ == "__main__":
     import uvicorn
     logger.info("Starting ArchWize API server")
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # uvloop and httptools replace the pure-Python event loop and HTTP parser.
+    # "auto" selects them when installed and falls back on platforms without
+    # uvloop (Windows). Multiple workers need the app as an import string.
+    uvicorn.run("main:app", host=HOST, port=PORT, loop="auto", http="auto", workers=WORKERS) 
\ No newline at end of file
@@ -0,0 +1,431 @@
+import logging
+import re
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Node shapes as (opener, closer); multi-character openers come first so they win
+_NODE_SHAPES = (
+    ("[[", "]]"), ("[(", ")]"), ("([", "])"), ("((", "))"), ("{{", "}}"),
+    ("[", "]"), ("(", ")"), ("{", "}"), (">", "]"),
+)
+
+# Keywords and operators of the accepted flowchart subset
+_DECL_KEYWORDS = frozenset({"graph", "flowchart"})
+_DIRECTIONS = frozenset({"TB", "TD", "BT", "RL", "LR"})
+_RAW_KEYWORDS = frozenset({"subgraph", "end", "style", "classDef", "class", "click", "linkStyle", "direction"})
+# Canonical link operators; longer links ("--->", "====>", "-..->") are normalized to these
+_LINK_OPS = ("<-.->", "<==>", "<-->", "-.->", "-->", "==>", "---", "===", "-.-")
+# Circle and cross edges end in a letter, so they only count when no word follows directly
+_LETTER_LINK_OPS = ("--o", "--x")
+# A link of any length: optional "<" head, a run of "-", "=" or dots between dashes, and an
+# optional ">" tail (or circle/cross tail on plain links)
+_LINK_RE = re.compile(r"(<)?(?:(-{2,})(>|[ox](?!\w))?|(={2,})(>)?|(-\.+-)(>)?)")
+# Text-on-link ("A -- yes --> B") opens with one of these and closes with an arrow
+_TEXT_LINK_OPENERS = ("--", "==", "-.")
+_TEXT_LINK_ARROWS = ("-->", "==>", "-.->")
+# Characters that cannot start link text: they belong to a plain link operator instead
+_TEXT_LINK_EXCLUDED = frozenset("-=.|;>")
+
+# Exactly what render_flowchart emits for node/link chains: quoted, trimmed labels,
+# single spaces, two-space indentation and a semicolon per statement. Keywords
+# are excluded as node ids because the lexer treats them as passthrough lines.
+_CANONICAL_LABEL = r'"(?:[^"\s;]|[^"\s][^"\n]*[^"\s;])?"'
+_CANONICAL_NODE = (
+    r"(?!(?:graph|flowchart|subgraph|end|style|classDef|class|click|linkStyle|direction)\b)\w+"
+    r"(?:" + "|".join(
+        f"{re.escape(opener)}{_CANONICAL_LABEL}{re.escape(closer)}" for opener, closer in _NODE_SHAPES
+    ) + r")?"
+    r"(?::::[\w-]+)?"
+)
+_CANONICAL_LINK = (
+    r"(?:" + "|".join(map(re.escape, _LINK_OPS)) + r"|(?:" + "|".join(map(re.escape, _LETTER_LINK_OPS)) + r")(?!\w))"
+    r"(?:\|[^|\s](?:[^|\n]*[^|\s])?\|)?"
+)
+_CANONICAL_BODY_RE = re.compile(
+    rf"(?:\n  {_CANONICAL_NODE}(?: (?:{_CANONICAL_LINK}|&) {_CANONICAL_NODE})*;)+"
+)
+
+
+class Node(NamedTuple):
+    """Reference to a flowchart node, optionally declaring its shape, label and class (A:::cls)."""
+    id: str
+    opener: Optional[str] = None
+    label: Optional[str] = None
+    closer: Optional[str] = None
+    css_class: Optional[str] = None
+
+
+class Link(NamedTuple):
+    """Connection operator between nodes with an optional condition label."""
+    op: str
+    label: Optional[str] = None
+
+
+# A statement is either a chain of nodes/links/"&" or a passthrough line (str)
+Statement = Union[List[Union[Node, Link, str]], str]
+
+
+def _normalize_link(match: "re.Match") -> Optional[str]:
+    """Map a `_LINK_RE` match of any length to its canonical operator, or None if it is not a link."""
+    head, dashes, dash_tail, thick, thick_tail, dotted, dotted_tail = match.groups()
+    tail = dash_tail or thick_tail or dotted_tail
+    if head is not None and tail != ">":
+        return None
+    if dashes is not None:
+        if tail is not None:
+            op = "--" + tail
+        elif len(dashes) >= 3:
+            op = "---"
+        else:
+            # "--" alone opens text on a link ("-- yes -->")
+            return None
+    elif thick is not None:
+        if tail is None and len(thick) < 3:
+            return None
+        op = "==>" if tail else "==="
+    else:
+        op = "-.->" if tail else "-.-"
+    return "<" + op if head else op
+
+
+def _finish_statement(items: list, statements: List[Statement]) -> bool:
+    """Validate a lexed chain and append it in normalized form; return False if it is discarded."""
+    if not items:
+        return True
+    normalized = []
+    for item in items:
+        previous = normalized[-1] if normalized else None
+        if isinstance(item, Node):
+            if isinstance(previous, Node):
+                # Two shaped nodes side by side are a connection missing its arrow;
+                # bare words side by side are prose, so the statement is dropped
+                if previous.opener is None or item.opener is None:
+                    return False
+                normalized.append(Link("-->"))
+            normalized.append(item)
+        elif isinstance(item, Link):
+            if not isinstance(previous, Node):
+                return False
+            normalized.append(item)
+        elif item == "&":
+            if not isinstance(previous, Node):
+                return False
+            normalized.append(item)
+        else:
+            # Condition label: attach it to the link it follows
+            if not isinstance(previous, Link) or previous.label is not None:
+                return False
+            normalized[-1] = previous._replace(label=item)
+    if not isinstance(normalized[-1], Node):
+        return False
+    statements.append(normalized)
+    return True
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class Flowchart(NamedTuple):
+    """Parsed flowchart: statements in source order, without the graph declaration."""
+    statements: List[Statement]
+
+    def render(self, orientation: str = "TD") -> str:
+        """Render the flowchart in canonical form; see `render_flowchart`."""
+        return render_flowchart(self.statements, orientation)
+
+
+class MermaidFlowchartParser:
+    """
+    Hand-written single-pass parser for the flowchart subset the model emits.
+
+    The buffer is scanned left to right with index arithmetic and `str.find`;
+    each character is examined a bounded number of times and nothing is
+    re-scanned by backtracking. Graph declarations and comments are dropped
+    (the renderer writes its own declaration). Statements that do not form a
+    valid node/link chain are discarded rather than guessed at, and logged.
+    """
+
+    def __init__(self):
+        self._code = ""
+        self._end = 0
+
+    def parse(self, code: str) -> Flowchart:
+        """
+        Parse the body of a Mermaid flowchart.
+
+        Args:
+            code (str): Mermaid flowchart code without Markdown fences
+
+        Returns:
+            Flowchart: Parsed statements in source order
+        """
+        self._code, self._end = code, len(code)
+        statements: List[Statement] = []
+        items: list = []
+        valid = True
+        start = pos = 0
+        while pos < self._end:
+            char = code[pos]
+            if char == ";" or char == "\n":
+                self._finish(items, valid, statements, start, pos)
+                items, valid = [], True
+                pos += 1
+                start = pos
+            elif char in " \t\r":
+                pos += 1
+            elif _is_word_char(char):
+                word_end = self._word_end(pos)
+                word = code[pos:word_end]
+                if word in _DECL_KEYWORDS:
+                    pos = self.parse_graph_decl(word_end)
+                elif word in _RAW_KEYWORDS:
+                    # Passthrough line (subgraph, styling, ...) kept as written
+                    stop = self._statement_end(word_end)
+                    if not items:
+                        statements.append(code[pos:stop].rstrip())
+                    else:
+                        valid = False
+                    pos = stop
+                else:
+                    node, pos = self.parse_node_ref(pos, word_end)
+                    items.append(node)
+            elif char == "&":
+                items.append("&")
+                pos += 1
+            elif char == "|":
+                label, pos = self.parse_condition(pos)
+                if label is None:
+                    valid = False
+                    pos += 1
+                else:
+                    items.append(label)
+            elif code.startswith("%%", pos):
+                newline = code.find("\n", pos)
+                pos = self._end if newline == -1 else newline
+            else:
+                link, label, end = self.parse_edge(pos)
+                if link is None:
+                    # Unrecognized text: skip the rest of this statement
+                    valid = False
+                    pos += 1
+                    continue
+                items.append(link)
+                if label is not None:
+                    items.append(label)
+                pos = end
+        self._finish(items, valid, statements, start, pos)
+        return Flowchart(statements)
+
+    def _finish(self, items: list, valid: bool, statements: List[Statement], start: int, end: int) -> None:
+        """Append the statement lexed from `start:end`, logging it if it has to be discarded."""
+        if valid and _finish_statement(items, statements):
+            return
+        text = self._code[start:end].strip()
+        if text:
+            logger.info("Discarding flowchart statement that could not be parsed: %r", text)
+
+    def parse_graph_decl(self, pos: int) -> int:
+        """Skip the optional direction after "graph"/"flowchart" ending at `pos`; return the new position."""
+        code = self._code
+        start = pos
+        while start < self._end and code[start] in " \t":
+            start += 1
+        if start > pos:
+            word_end = self._word_end(start)
+            if code[start:word_end] in _DIRECTIONS:
+                return word_end
+        return pos
+
+    def parse_node_ref(self, pos: int, word_end: int) -> Tuple[Node, int]:
+        """Parse a node id spanning `pos:word_end` plus an optional shape, label and :::class."""
+        code = self._code
+        node = Node(code[pos:word_end])
+        end = word_end
+        for opener, closer in _NODE_SHAPES:
+            if not code.startswith(opener, word_end):
+                continue
+            start = word_end + len(opener)
+            close = self._shape_close(start, closer)
+            if close != -1:
+                node = node._replace(opener=opener, label=code[start:close], closer=closer)
+                end = close + len(closer)
+                break
+        if code.startswith(":::", end):
+            class_end = end + 3
+            while class_end < self._end and (_is_word_char(code[class_end]) or code[class_end] == "-"):
+                class_end += 1
+            if class_end > end + 3:
+                node = node._replace(css_class=code[end + 3:class_end])
+                end = class_end
+        return node, end
+
+    def parse_edge(self, pos: int) -> Tuple[Optional[Link], Optional[str], int]:
+        """
+        Parse a link operator at `pos`, including text-on-link ("-- yes -->").
+
+        Returns:
+            tuple: (link, condition label or None, end position); link is None
+                if no operator starts at `pos`
+        """
+        code = self._code
+        match = _LINK_RE.match(code, pos)
+        op = _normalize_link(match) if match is not None else None
+        if op is not None:
+            return Link(op), None, match.end()
+        for opener in _TEXT_LINK_OPENERS:
+            if not code.startswith(opener, pos):
+                continue
+            first = pos + len(opener)
+            while first < self._end and code[first] in " \t":
+                first += 1
+            if first == self._end or code[first].isspace() or code[first] in _TEXT_LINK_EXCLUDED:
+                break
+            # The text runs to the nearest arrow on the same statement
+            limit = self._end
+            for stop in ("\n", ";", "|"):
+                index = code.find(stop, first + 1, limit)
+                if index != -1:
+                    limit = index
+            arrow_at, arrow = -1, None
+            for candidate in _TEXT_LINK_ARROWS:
+                index = code.find(candidate, first + 1, limit)
+                if index != -1 and (arrow_at == -1 or index < arrow_at):
+                    arrow_at, arrow = index, candidate
+            if arrow is not None:
+                # Longer arrows ("-- yes --->") keep their extra dashes out of the text
+                text_end = arrow_at
+                while text_end > first + 1 and code[text_end - 1] == arrow[0]:
+                    text_end -= 1
+                return Link(arrow), code[first:text_end].rstrip(" \t"), arrow_at + len(arrow)
+            break
+        return None, None, pos
+
+    def parse_condition(self, pos: int) -> Tuple[Optional[str], int]:
+        """Parse a |label| at `pos`; doubled pipes ("||Valid||") are a common model mistake."""
+        code = self._code
+        run_end = self._pipe_run_end(pos)
+        close = self._end
+        for stop in ("|", "\n"):
+            index = code.find(stop, run_end, close)
+            if index != -1:
+                close = index
+        if close < self._end and code[close] == "|":
+            end = self._pipe_run_end(close)
+        elif run_end - pos >= 2:
+            # Only pipes before the line ends: an empty label
+            end = run_end
+        else:
+            return None, pos
+        return code[pos:end].strip("|").strip(), end
+
+    def _word_end(self, pos: int) -> int:
+        code = self._code
+        while pos < self._end and _is_word_char(code[pos]):
+            pos += 1
+        return pos
+
+    def _pipe_run_end(self, pos: int) -> int:
+        code = self._code
+        while pos < self._end and code[pos] == "|":
+            pos += 1
+        return pos
+
+    def _statement_end(self, pos: int) -> int:
+        end = self._end
+        for stop in (";", "\n"):
+            index = self._code.find(stop, pos, end)
+            if index != -1:
+                end = index
+        return end
+
+    def _shape_close(self, start: int, closer: str) -> int:
+        """Return where `closer` ends a node label starting at `start`, or -1."""
+        code = self._code
+        # A quoted label may contain anything but a newline and must be followed by the closer
+        if code.startswith('"', start):
+            quote = code.find('"', start + 1)
+            newline = code.find("\n", start + 1)
+            if quote != -1 and (newline == -1 or newline > quote) and code.startswith(closer, quote + 1):
+                return quote + 1
+        # Otherwise the label runs to the first closer on the same line (it may contain ";")
+        close = code.find(closer, start)
+        if close == -1 or code.find("\n", start, close) != -1:
+            return -1
+        return close
+
+
+def parse_flowchart(code: str) -> List[Statement]:
+    """
+    Parse the body of a Mermaid flowchart in a single pass.
+
+    Args:
+        code (str): Mermaid flowchart code without Markdown fences
+
+    Returns:
+        list: Parsed statements in source order
+    """
+    return MermaidFlowchartParser().parse(code).statements
+
+
+def _render_class(node: Node) -> str:
+    return f":::{node.css_class}" if node.css_class else ""
+
+
+def _render_node(node: Node) -> str:
+    if node.opener is None:
+        return node.id + _render_class(node)
+    # Quote every label; inner quotes and stray semicolons break the renderer
+    label = node.label.strip()
+    if len(label) >= 2 and label[0] == '"' and label[-1] == '"':
+        label = label[1:-1]
+    label = label.replace('"', "'").rstrip("; \t").strip()
+    return f'{node.id}{node.opener}"{label}"{node.closer}{_render_class(node)}'
+
+
+def render_flowchart(statements: List[Statement], orientation: str = "TD") -> str:
+    """
+    Render parsed statements as canonical Mermaid code.
+
+    Args:
+        statements (list): Output of `parse_flowchart`
+        orientation (str): Diagram orientation, either "TD" (top-down) or "LR" (left-right)
+
+    Returns:
+        str: Flowchart with the requested orientation, one statement per line,
+            two-space indentation and a semicolon after every node/link statement
+    """
+    lines = [f"graph {orientation};"]
+    for statement in statements:
+        if isinstance(statement, str):
+            lines.append(f"  {statement}")
+            continue
+        parts = []
+        for item in statement:
+            if isinstance(item, Node):
+                parts.append(_render_node(item))
+            elif isinstance(item, Link):
+                parts.append(f"{item.op}|{item.label}|" if item.label else item.op)
+            else:
+                parts.append(item)
+        lines.append(f"  {' '.join(parts)};")
+    return "\n".join(lines)
+
+
+def is_canonical_flowchart(code: str, orientation: str = "TD") -> bool:
+    """
+    Check whether flowchart code is already in the form `render_flowchart` emits.
+
+    Only plain node/link statements are recognized; anything else (subgraphs,
+    styling, unquoted labels) returns False and should go through the parser.
+
+    Args:
+        code (str): Mermaid flowchart code without Markdown fences
+        orientation (str): Expected orientation, either "TD" or "LR"
+
+    Returns:
+        bool: True if parsing and re-rendering would return `code` unchanged
+    """
+    header = f"graph {orientation};"
+    return code.startswith(header) and _CANONICAL_BODY_RE.fullmatch(code, len(header)) is not None
@@ -7,11 +7,14 @@ This script runs the tests and provides a clear report of the results.
 import os
 import sys
 import subprocess
-import requests
-import json
+import httpx
+import orjson
 import time
 from datetime import datetime
 
+# Shared client so the server check and sample requests reuse one connection
+_CLIENT = httpx.Client(http2=True, headers={"Content-Type": "application/json"})
+
 def print_header(text):
     """Print a formatted header."""
     terminal_width = 80
@@ -22,7 +25,7 @@ def print_header(text):
 def check_server_running():
     """Check if the backend server is running."""
     try:
-        response = requests.get("http://localhost:8000/")
+        response = _CLIENT.get("http://localhost:8000/")
         if response.status_code == 200:
             return True
     except:
@@ -49,10 +52,10 @@ def sample_test_requests():
     for prompt in test_requests:
         print(f"Testing: {prompt}")
         try:
-            response = requests.post("http://localhost:8000/generate", 
-                                   json={"prompt": prompt}, timeout=30)
+            response = _CLIENT.post("http://localhost:8000/generate", 
+                                  content=orjson.dumps({"prompt": prompt}), timeout=30)
             if response.status_code == 200:
-                mermaid_code = response.json().get("mermaid_code", "")
+                mermaid_code = orjson.loads(response.content).get("mermaid_code", "")
                 
                 # Basic validation
                 is_valid = "graph TD" in mermaid_code and "-->" in mermaid_code
@@ -88,8 +91,8 @@ def save_test_results(results):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"test_results_{timestamp}.json"
     
-    with open(filename, "w") as f:
-        json.dump(results, f, indent=2)
+    with open(filename, "wb") as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
     
     print(f"\nTest results saved to {filename}")
 
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency (requirements-semantic.txt)
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Partition:
+    """
+    Embeddings and diagrams for a single orientation, stored side by side.
+
+    Holds at most `maxsize` entries; once full, each new entry overwrites the
+    oldest one (FIFO), so memory and lookup cost stay bounded.
+    """
+
+    def __init__(self, dim: int, maxsize: int, capacity: int = 64):
+        self.maxsize = max(1, maxsize)
+        self.embeddings = np.zeros((min(capacity, self.maxsize), dim), dtype=np.float32)
+        self.codes: List[str] = []
+        self._oldest = 0  # Slot overwritten next once the partition is full
+
+    def append(self, embedding: np.ndarray, code: str) -> None:
+        size = len(self.codes)
+        if size == self.maxsize:
+            self.embeddings[self._oldest] = embedding
+            self.codes[self._oldest] = code
+            self._oldest = (self._oldest + 1) % self.maxsize
+            return
+        if size == self.embeddings.shape[0]:
+            # Grow geometrically (up to maxsize) so appends stay amortized O(1)
+            grown = np.zeros((min(size * 2, self.maxsize), self.embeddings.shape[1]), dtype=np.float32)
+            grown[:size] = self.embeddings
+            self.embeddings = grown
+        self.embeddings[size] = embedding
+        self.codes.append(code)
+
+
+class SemanticCache:
+    """
+    Cache that serves a previously generated diagram when a new prompt is
+    semantically close to one that has already been answered.
+
+    Prompts are embedded with a sentence-transformers model and compared by
+    cosine similarity against every cached prompt for the same orientation.
+    """
+
+    def __init__(self, model_name: str, threshold: float = 0.87, top_k: int = 1, maxsize: int = 1024):
+        """
+        Load the embedding model.
+
+        Args:
+            model_name (str): sentence-transformers model used to embed prompts
+            threshold (float): Minimum cosine similarity required for a hit
+            top_k (int): Number of nearest cached prompts to consider per lookup
+            maxsize (int): Maximum cached prompts per orientation; the oldest are evicted first
+        """
+        from sentence_transformers import SentenceTransformer
+
+        self.threshold = threshold
+        self.top_k = max(1, top_k)
+        self.maxsize = maxsize
+        self._model = SentenceTransformer(model_name)
+        self._dim = self._model.get_sentence_embedding_dimension()
+        self._partitions: Dict[str, _Partition] = {}
+        self._lock = threading.Lock()
+
+    def embed(self, prompt: str) -> np.ndarray:
+        """
+        Embed a prompt into a normalized float32 vector.
+
+        Args:
+            prompt (str): User's diagram description/request
+
+        Returns:
+            np.ndarray: Unit-length embedding of shape (dim,)
+        """
+        return self._model.encode(
+            prompt, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32, copy=False)
+
+    def lookup(self, embedding: np.ndarray, orientation: str) -> Optional[str]:
+        """
+        Find the cached diagram whose prompt is most similar to the query.
+
+        Args:
+            embedding (np.ndarray): Query embedding from `embed`
+            orientation (str): Diagram orientation, either "TD" or "LR"
+
+        Returns:
+            Optional[str]: Cached Mermaid.js code, or None if nothing is close enough
+        """
+        with self._lock:
+            partition = self._partitions.get(orientation)
+            if partition is None or not partition.codes:
+                return None
+            size = len(partition.codes)
+            # Embeddings are normalized, so the dot product is the cosine similarity
+            scores = partition.embeddings[:size] @ embedding
+            if self.top_k < size:
+                candidates = np.argpartition(scores, -self.top_k)[-self.top_k:]
+            else:
+                candidates = np.arange(size)
+            best = int(candidates[np.argmax(scores[candidates])])
+            if scores[best] < self.threshold:
+                return None
+            logger.debug("Semantic cache hit (similarity %.3f)", scores[best])
+            return partition.codes[best]
+
+    def add(self, embedding: np.ndarray, orientation: str, code: str) -> None:
+        """
+        Store a generated diagram under the embedding of its prompt.
+
+        Args:
+            embedding (np.ndarray): Prompt embedding from `embed`
+            orientation (str): Diagram orientation, either "TD" or "LR"
+            code (str): Cleaned Mermaid.js code to serve on future hits
+        """
+        with self._lock:
+            partition = self._partitions.get(orientation)
+            if partition is None:
+                partition = self._partitions[orientation] = _Partition(self._dim, self.maxsize)
+            partition.append(embedding, code)
+
+
+def create_semantic_cache(
+    enabled: bool, model_name: str, threshold: float, top_k: int, maxsize: int = 1024
+) -> Optional[SemanticCache]:
+    """
+    Build the process-wide semantic cache, or return None when it is disabled
+    or the embedding model cannot be loaded.
+    """
+    if not enabled:
+        return None
+    if np is None:
+        logger.warning("Semantic cache disabled: numpy and sentence-transformers are not installed (see requirements-semantic.txt)")
+        return None
+    try:
+        return SemanticCache(model_name, threshold=threshold, top_k=top_k, maxsize=maxsize)
+    except Exception as e:
+        logger.warning("Semantic cache disabled: could not load embedding model %s (%s)", model_name, e)
+        return None
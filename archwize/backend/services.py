@@ -1,53 +1,182 @@
-import requests
-import json
-import os
-from dotenv import load_dotenv
-from config import HUGGINGFACE_API_TOKEN
+import asyncio
+import hashlib
+import httpx
+import logging
+import orjson
+import threading
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
+from config import (
+    BATCH_MAX_SIZE,
+    BATCH_MAX_WAIT_MS,
+    DEFAULT_INFERENCE_API_URL,
+    DIAGRAM_CACHE_DIR,
+    DIAGRAM_CACHE_MAXSIZE,
+    DIAGRAM_CACHE_SIZE_MB,
+    DIAGRAM_CACHE_TTL,
+    HF_MAX_INFLIGHT,
+    HF_RATE_LIMIT_PER_MINUTE,
+    HUGGINGFACE_API_TOKEN,
+    INFERENCE_API_URL,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_MAXSIZE,
+    SEMANTIC_CACHE_MODEL,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TOP_K,
+    WARMUP_ON_STARTUP,
+)
+from semantic_cache import create_semantic_cache
+from batching import PromptBatcher
+from mermaid_parser import MermaidFlowchartParser, is_canonical_flowchart
 import re
+import textwrap
+from functools import lru_cache
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-class DiagramService:
-    """Service for generating diagrams using free Hugging Face models."""
-    
-    @staticmethod
-    async def generate_mermaid_diagram(prompt: str, orientation="TD") -> str:
-        """
-        Generate a Mermaid.js diagram based on a user prompt using a free Hugging Face model.
-        
-        Args:
-            prompt (str): User's diagram description/request
-            orientation (str): Diagram orientation, either "TD" (top-down) or "LR" (left-right)
-            
-        Returns:
-            str: Mermaid.js syntax for the requested diagram
-            
-        Raises:
-            ValueError: If diagram generation fails or produces invalid output
-        """
-        print(f"Generating diagram for prompt: {prompt} with orientation: {orientation}")
-        
-        # Using Hugging Face's free inference API with the Mistral model
-        huggingface_api_url = "https://api-inference.huggingface.co/models/mistralai/Mistral-7B-Instruct-v0.2"
-        
-        # Include the API token in the headers
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # Add authorization if token is available
-        if HUGGINGFACE_API_TOKEN:
-            headers["Authorization"] = f"Bearer {HUGGINGFACE_API_TOKEN}"
-        else:
-            print("WARNING: HUGGINGFACE_API_TOKEN not found in environment variables. API calls will fail.")
-            raise ValueError("Missing API token for Hugging Face. Please check your configuration.")
-        
-        # Adjust the orientation in the example based on user preference
-        flow_direction = "TD" if orientation == "TD" else "LR"
-        orientation_description = "top-down" if orientation == "TD" else "left-to-right"
-        
-        system_prompt = f"""
+# Body of the first Markdown code block; an unterminated block runs to the end of the text
+_FENCE_RE = re.compile(r"```(?:mermaid\b)?(.*?)(?:```|\Z)", re.S)
+# Any diagram type declaration, as a whole word so prose like "copier" or "paragraph" does not match
+_DIAGRAM_KIND_RE = re.compile(r"\b(?:graph|flowchart|sequenceDiagram|classDiagram|erDiagram|stateDiagram|gantt|pie)\b")
+# Flowcharts go through the parser wherever their declaration appears
+_FLOWCHART_DECL_RE = re.compile(r"\b(?:graph|flowchart)\b")
+# Checkout detection: one case-insensitive scan instead of lowercasing and testing each keyword
+_CHECKOUT_PROMPT_RE = re.compile("checkout|shopping cart|payment", re.IGNORECASE)
+_CHECKOUT_CODE_RE = re.compile("checkout|shopping|payment", re.IGNORECASE)
+
+# How many flowcharts came back already canonical and skipped the parser;
+# the running hit rate is logged every _FAST_PATH_LOG_EVERY flowcharts
+_FAST_PATH_STATS = {"hits": 0, "total": 0}
+_FAST_PATH_LOG_EVERY = 100
+
+def _record_fast_path(hit: bool) -> None:
+    _FAST_PATH_STATS["total"] += 1
+    if hit:
+        _FAST_PATH_STATS["hits"] += 1
+    total = _FAST_PATH_STATS["total"]
+    if total % _FAST_PATH_LOG_EVERY == 0:
+        logger.info("Canonical fast path hit rate: %d/%d flowcharts", _FAST_PATH_STATS["hits"], total)
+
+# Transient inference API statuses (rate limiting, model loading, gateway errors)
+# are retried with exponential backoff, honoring Retry-After when it is sent
+_RETRY_STATUSES = frozenset({429, 502, 503, 504})
+_MAX_RETRIES = 2
+_RETRY_BACKOFF = 0.2
+_RETRY_MAX_DELAY = 10.0
+
+# Shared async HTTP client so connections (and TLS sessions) to Hugging Face are
+# reused; created on first use and closed by DiagramService.aclose() at shutdown
+_HTTP = None
+
+def _http_client() -> httpx.AsyncClient:
+    global _HTTP
+    if _HTTP is None or _HTTP.is_closed:
+        _HTTP = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                # Keep idle connections well past httpx's 5s default so bursts spaced
+                # further apart still skip the TCP and TLS handshakes
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=75.0),
+                # Retry failed connection attempts; error statuses are retried by the callers
+                retries=_MAX_RETRIES,
+            ),
+            # Batched calls wait for whole generations, so reads get longer than connects
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        )
+    return _HTTP
+
+# Caps concurrent inference calls so bursts wait here (and batch up behind the
+# batcher) instead of opening a socket each and tripping the API's rate limits
+_INFERENCE_SEMAPHORE = asyncio.Semaphore(HF_MAX_INFLIGHT)
+
+# Spreads calls (retries included) over the endpoint's per-minute quota; None when unlimited
+_RATE_LIMITER = AsyncLimiter(HF_RATE_LIMIT_PER_MINUTE, 60) if HF_RATE_LIMIT_PER_MINUTE > 0 else None
+
+# Bump whenever the prompt template or post-processing changes so stale diagrams are not served
+_PROMPT_VERSION = "1"
+
+# Exact-match cache of request key -> cleaned Mermaid code, bounded in size and age
+_EXACT_CACHE = TTLCache(maxsize=DIAGRAM_CACHE_MAXSIZE, ttl=DIAGRAM_CACHE_TTL)
+_EXACT_CACHE_LOCK = threading.Lock()
+
+def _create_disk_cache():
+    """
+    Open the on-disk diagram cache shared by all workers, or return None when
+    it is disabled or cannot be opened.
+    """
+    if not DIAGRAM_CACHE_DIR:
+        return None
+    try:
+        import diskcache
+        return diskcache.Cache(DIAGRAM_CACHE_DIR, size_limit=DIAGRAM_CACHE_SIZE_MB * 1024 * 1024)
+    except Exception as e:
+        logger.warning("Persistent diagram cache disabled: could not open %s (%s)", DIAGRAM_CACHE_DIR, e)
+        return None
+
+# Second tier behind the in-memory cache, so restarts and other workers keep cached diagrams.
+# Opened by DiagramService.startup() in each worker rather than at import, so the
+# supervisor process of a multi-worker server never opens it
+_DISK_CACHE = None
+
+async def _cached_diagram(cache_key: str):
+    """Look a request up in memory, then on disk, promoting disk hits into memory."""
+    with _EXACT_CACHE_LOCK:
+        cached_code = _EXACT_CACHE.get(cache_key)
+    if cached_code is None and _DISK_CACHE is not None:
+        # diskcache reads SQLite and files synchronously; keep that off the event loop
+        try:
+            cached_code = await asyncio.to_thread(_DISK_CACHE.get, cache_key)
+        except Exception as e:
+            # Lock contention between workers or I/O errors: treat as a miss
+            logger.warning("Persistent diagram cache read failed (%s); using the in-memory cache only", e)
+            return None
+        if cached_code is not None:
+            with _EXACT_CACHE_LOCK:
+                _EXACT_CACHE[cache_key] = cached_code
+    return cached_code
+
+async def _store_diagram(cache_key: str, code: str) -> None:
+    """Store a diagram in memory and on disk under the same expiry."""
+    with _EXACT_CACHE_LOCK:
+        _EXACT_CACHE[cache_key] = code
+    if _DISK_CACHE is not None:
+        try:
+            await asyncio.to_thread(_DISK_CACHE.set, cache_key, code, expire=DIAGRAM_CACHE_TTL)
+        except Exception as e:
+            # The diagram is already cached in memory; a failed write must not fail the request
+            logger.warning("Persistent diagram cache write failed (%s); keeping it in memory only", e)
+
+def _request_key(prompt: str, flow_direction: str) -> str:
+    """Hash a request so prompts differing only in case or surrounding whitespace share an entry."""
+    normalized = prompt.strip().lower()
+    return hashlib.sha256(f"{_PROMPT_VERSION}\0{flow_direction}\0{normalized}".encode()).hexdigest()
+
+# Generations currently in progress, keyed like the exact-match cache;
+# concurrent identical requests await the same task instead of calling the API again
+_INFLIGHT = {}
+
+# Embedding model, loaded once per worker by DiagramService.startup(); None when disabled
+_SEMANTIC_CACHE = None
+_STARTED = False
+
+def _semantic_lookup(prompt: str, flow_direction: str) -> tuple:
+    """Embed a prompt and look it up in the semantic cache; returns (embedding, cached code or None)."""
+    embedding = _SEMANTIC_CACHE.embed(prompt)
+    return embedding, _SEMANTIC_CACHE.lookup(embedding, flow_direction)
+
+# Marks where the user's request is substituted into a prebuilt prompt template
+_PROMPT_PLACEHOLDER = "{{PROMPT}}"
+
+def _compact_prompt(text: str) -> str:
+    """Strip source indentation and trailing spaces, which cost payload bytes and tokens on every call."""
+    return "\n".join(line.rstrip() for line in textwrap.dedent(text).strip().splitlines())
+
+# Static instructions shared by every request. Nothing request- or
+# orientation-specific appears here, so the prompt prefix is identical across
+# calls and servers with prefix caching can reuse its KV cache.
+_STATIC_PROMPT_PREFIX = "<s>[INST] " + _compact_prompt("""
         You are an AI designed to generate **valid, properly formatted Mermaid.js diagrams** based on user descriptions.  
         Ensure that your response strictly follows these rules:
 
@@ -56,14 +185,13 @@ class DiagramService:
         3. **Verify that the graph structure is correct** (e.g., each node is properly connected with arrows).
         4. **Avoid adding redundant labels**—keep node names concise and meaningful.
         5. **Ensure all text inside nodes is enclosed in quotes** to prevent rendering issues.
-        6. **Use {orientation_description} orientation** (graph {flow_direction}) for this diagram.
-        7. **Every node connection must end with a semicolon** (e.g., `NodeA --> NodeB;`)
-        8. **All conditional paths must be properly formatted** (e.g., `NodeA --> |Condition| NodeB;`)
-        9. **Ensure every node is connected correctly** - don't leave nodes disconnected or missing arrows.
+        6. **Every node connection must end with a semicolon** (e.g., `NodeA --> NodeB;`)
+        7. **All conditional paths must be properly formatted** (e.g., `NodeA --> |Condition| NodeB;`)
+        8. **Ensure every node is connected correctly** - don't leave nodes disconnected or missing arrows.
 
-        Example of a properly formatted user registration flowchart with {orientation_description} orientation:
+        Example of a properly formatted user registration flowchart:
         ```
-        graph {flow_direction};
+        graph TD;
           Start["User Begins Registration"] --> Register["Register User"];
           Register --> EnterDetails["Enter User Details"];
           EnterDetails --> Validate["Validate Input"];
@@ -75,7 +203,7 @@ class DiagramService:
         
         For complex flowcharts with multiple paths, make sure each path has proper arrows and semicolons:
         ```
-        graph {flow_direction};
+        graph TD;
           Start["Begin Checkout"] --> Cart["View Cart"];
           Cart --> Address["Enter Address"];
           Address --> Payment["Choose Payment"];
@@ -96,191 +224,563 @@ class DiagramService:
         - Each connection must end with a semicolon (;)
         - No redundant quotes in node names 
         - Consistent indentation for readability (two spaces)
-        - Start with 'graph {flow_direction};' at the top
+        - Start with the graph declaration at the top
         - Only output valid Mermaid.js code, nothing else
         
         Do not include any explanations, text, or markdown formatting outside the diagram code.
-        """
+        """)
+
+def _build_prompt_template(flow_direction: str, orientation_description: str) -> str:
+    """
+    Append the orientation directive and the user request slot to the shared
+    instruction prefix. Everything that varies comes after the static block.
+    """
+    return (
+        f"{_STATIC_PROMPT_PREFIX}\n\n"
+        f"Use {orientation_description} orientation and start the diagram with 'graph {flow_direction};'.\n\n"
+        f"Here's the user request: {_PROMPT_PLACEHOLDER} [/INST]"
+    )
+
+# Only the short tail varies by orientation, so both variants are built once at import
+_PROMPT_TEMPLATES = {
+    "TD": _build_prompt_template("TD", "top-down"),
+    "LR": _build_prompt_template("LR", "left-to-right"),
+}
+
+def _encode_template(template: str) -> tuple:
+    """Split a prompt template at the placeholder and JSON-encode both halves, minus their outer quotes."""
+    head, tail = template.split(_PROMPT_PLACEHOLDER)
+    return orjson.dumps(head)[:-1], orjson.dumps(tail)[1:]
+
+# JSON-encoded template halves, so each request only escapes the user's prompt
+# instead of re-encoding the whole ~2.5 KB instruction block
+_ENCODED_TEMPLATES = {
+    flow_direction: _encode_template(template) for flow_direction, template in _PROMPT_TEMPLATES.items()
+}
+
+def _encode_model_input(prompt: str, flow_direction: str) -> bytes:
+    """Return the full model input for a prompt as a JSON string literal."""
+    head, tail = _ENCODED_TEMPLATES[flow_direction]
+    return head + orjson.dumps(prompt)[1:-1] + tail
+
+# Generation parameters are identical for every request, so they are encoded once
+_GENERATION_PARAMETERS = orjson.dumps({
+    "max_new_tokens": 1024,
+    "temperature": 0.5,  # Lower temperature for more structured output
+    "top_p": 0.95,
+    "return_full_text": False
+})
+
+# Request headers never change after startup, so they are built once and shared
+_REQUEST_HEADERS = {
+    "Content-Type": "application/json"
+}
+# Self-hosted endpoints may not need a token; send one whenever it is configured
+if HUGGINGFACE_API_TOKEN:
+    _REQUEST_HEADERS["Authorization"] = f"Bearer {HUGGINGFACE_API_TOKEN}"
+
+class InferenceAPIError(ValueError):
+    """Error status returned by the inference API."""
+    
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+def _raise_api_error(response: httpx.Response):
+    # Log the error and raise an exception
+    logger.error("Error from Hugging Face API: %s - %s", response.status_code, response.text)
+    raise InferenceAPIError(
+        f"Diagram generation failed: Error from Hugging Face API: {response.status_code} - {response.text}",
+        response.status_code,
+    )
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    retry_after = response.headers.get("Retry-After", "")
+    if retry_after.isdigit():
+        return min(float(retry_after), _RETRY_MAX_DELAY)
+    return _RETRY_BACKOFF * 2 ** attempt
+
+@asynccontextmanager
+async def _inference_slot() -> AsyncIterator[None]:
+    """Wait for rate-limit capacity, then hold one of the concurrent inference slots."""
+    if _RATE_LIMITER is not None:
+        await _RATE_LIMITER.acquire()
+    async with _INFERENCE_SEMAPHORE:
+        yield
+
+@asynccontextmanager
+async def _open_stream(payload: bytes) -> AsyncIterator[httpx.Response]:
+    """
+    Open a streaming inference request, retrying transient error statuses.
+    
+    Args:
+        payload (bytes): JSON request body
         
-        # Format the payload for Mistral
-        payload = {
-            "inputs": f"<s>[INST] {system_prompt}\n\nHere's the user request: {prompt} [/INST]",
-            "parameters": {
-                "max_new_tokens": 1024,
-                "temperature": 0.5,  # Lower temperature for more structured output
-                "top_p": 0.95,
-                "return_full_text": False
-            }
-        }
+    Yields:
+        httpx.Response: Response with status 200, body not yet read
         
-        try:
-            print(f"Sending request to Hugging Face API...")
-            response = requests.post(huggingface_api_url, headers=headers, json=payload)
-            
+    Raises:
+        ValueError: If the API returns a non-retryable status or retries run out
+    """
+    for attempt in range(_MAX_RETRIES + 1):
+        async with _inference_slot(), _http_client().stream("POST", INFERENCE_API_URL, headers=_REQUEST_HEADERS, content=payload) as response:
             if response.status_code == 200:
-                # Extract the generated text
-                result = response.json()[0]["generated_text"]
-                print(f"API response successful, processing result")
-                
-                # Clean and format the response, preserving the orientation
-                cleaned_code = await DiagramService.clean_mermaid_code(result, orientation)
-                
-                # Check if this is a checkout diagram and use a specialized formatter
-                if "checkout" in prompt.lower() or "shopping cart" in prompt.lower() or "payment" in prompt.lower():
-                    print("Detected checkout diagram, applying specialized formatter")
-                    return DiagramService.format_checkout_diagram(cleaned_code, orientation)
-                
-                return cleaned_code
-            else:
-                # Log the error and raise an exception
-                error_msg = f"Error from Hugging Face API: {response.status_code} - {response.text}"
-                print(f"ERROR: {error_msg}")
-                raise ValueError(f"Diagram generation failed: {error_msg}")
-        except Exception as e:
-            # Log the error and raise an exception
-            error_msg = f"Error generating diagram: {str(e)}"
-            print(f"ERROR: {error_msg}")
-            raise ValueError(error_msg)
+                yield response
+                return
+            await response.aread()
+            if response.status_code not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+                _raise_api_error(response)
+            delay = _retry_delay(response, attempt)
+        # Back off outside the slot so it is free while waiting
+        logger.warning("Hugging Face API returned %s, retrying in %.1fs", response.status_code, delay)
+        await asyncio.sleep(delay)
+
+async def _post_inference(payload: bytes) -> httpx.Response:
+    """
+    Send a non-streaming inference request, retrying transient error statuses.
+    
+    Args:
+        payload (bytes): JSON request body
+        
+    Returns:
+        httpx.Response: Response with status 200
+        
+    Raises:
+        ValueError: If the API returns a non-retryable status or retries run out
+    """
+    for attempt in range(_MAX_RETRIES + 1):
+        async with _inference_slot():
+            response = await _http_client().post(INFERENCE_API_URL, headers=_REQUEST_HEADERS, content=payload)
+        if response.status_code == 200:
+            return response
+        if response.status_code not in _RETRY_STATUSES or attempt == _MAX_RETRIES:
+            _raise_api_error(response)
+        delay = _retry_delay(response, attempt)
+        logger.warning("Hugging Face API returned %s, retrying in %.1fs", response.status_code, delay)
+        await asyncio.sleep(delay)
+
+async def _iter_completion(model_input: bytes) -> AsyncIterator[str]:
+    """
+    Stream a single completion token by token and stop reading once the
+    diagram's closing code fence arrives. Closing the stream early also stops
+    generation server-side, so the model does not spend the rest of
+    max_new_tokens on trailing text.
+    
+    Args:
+        model_input (bytes): Model input from `_encode_model_input`
+        
+    Yields:
+        str: Generated text fragments, up to and including the closing fence
+        
+    Raises:
+        ValueError: If the API returns an error status or an error event
+    """
+    payload = b'{"inputs":' + model_input + b',"parameters":' + _GENERATION_PARAMETERS + b',"stream":true}'
+    
+    logger.debug("Streaming prompt to Hugging Face API")
+    text = ""
+    fences = 0
+    scan_from = 0
+    async with _open_stream(payload) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            event = orjson.loads(line[5:])
+            if "error" in event:
+                raise ValueError(f"Diagram generation failed: Error from Hugging Face API: {event['error']}")
+            token = event.get("token") or {}
+            if token.get("special"):
+                continue
+            fragment = token.get("text", "")
+            text += fragment
+            yield fragment
+            
+            # Count fences incrementally; a fence may be split across tokens
+            fence = text.find("```", scan_from)
+            while fence != -1:
+                fences += 1
+                scan_from = fence + 3
+                fence = text.find("```", scan_from)
+            scan_from = max(scan_from, len(text) - 2)
+            
+            # Opening and closing fence seen: the diagram is complete
+            if fences >= 2:
+                break
+
+async def _stream_completion(model_input: bytes) -> str:
+    """
+    Collect a streamed completion, cut off at the diagram's closing code fence.
+    
+    Args:
+        model_input (bytes): Model input from `_encode_model_input`
+        
+    Returns:
+        str: Generated text up to and including the closing fence
+    """
+    return "".join([fragment async for fragment in _iter_completion(model_input)])
+
+async def _request_completions(inputs_batch: List[bytes]) -> list:
+    """
+    Send one or more formatted model inputs to the Hugging Face API in a single call.
+    
+    Args:
+        inputs_batch (List[bytes]): Model inputs from `_encode_model_input`
+        
+    Returns:
+        list: Generated text (or the exception raised generating it) for each
+            input, in the same order
+        
+    Raises:
+        ValueError: If the API returns an error status
+    """
+    # A lone prompt is streamed so generation can be cut off at the closing fence
+    if len(inputs_batch) == 1:
+        return [await _stream_completion(inputs_batch[0])]
+    
+    payload = b'{"inputs":[' + b",".join(inputs_batch) + b'],"parameters":' + _GENERATION_PARAMETERS + b'}'
+    
+    logger.debug("Sending %d prompts to Hugging Face API", len(inputs_batch))
+    try:
+        response = await _post_inference(payload)
+    except InferenceAPIError as e:
+        # Endpoints that only take a single string input (text-generation-inference)
+        # reject the list; rate limiting is not a schema problem, so it is not resent
+        if not 400 <= e.status_code < 500 or e.status_code == 429:
+            raise
+        logger.warning("Batched request rejected with %s; sending %d prompts individually", e.status_code, len(inputs_batch))
+        return await asyncio.gather(*(_stream_completion(model_input) for model_input in inputs_batch), return_exceptions=True)
+    
+    # Batched inputs come back as one list of generations per input
+    results = orjson.loads(response.content)
+    return [(result[0] if isinstance(result, list) else result)["generated_text"] for result in results]
+
+# Prompts arriving within a few milliseconds of each other share one API call
+_BATCHER = PromptBatcher(_request_completions, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+
+def _warmup_local():
+    """Run the embedding model and the flowchart parser once so the first request does not pay for it."""
+    if _SEMANTIC_CACHE is not None:
+        _SEMANTIC_CACHE.embed("warmup")
+    MermaidFlowchartParser().parse('graph TD;\n  A["Warmup"] --> B;').render("TD")
+
+# Fallback topics in priority order, with the prompt substrings that select them
+_FALLBACK_TOPICS = ("login", "registration", "checkout", "API request")
+_TOPIC_ALIASES = {
+    "login": "login",
+    "registration": "registration",
+    "register": "registration",
+    "checkout": "checkout",
+    "payment": "checkout",
+    "api": "API request",
+}
+_TOPIC_RE = re.compile("|".join(sorted(_TOPIC_ALIASES, key=len, reverse=True)))
+
+# Fallback diagram bodies per topic, without the graph declaration
+_FALLBACK_BODIES = {
+    "login": (
+        '  Start["User Begins Login"] --> EnterCredentials["Enter Credentials"];\n'
+        '  EnterCredentials --> ValidateCredentials["Validate Credentials"];\n'
+        '  ValidateCredentials -->|Valid| Success["Login Successful"];\n'
+        '  ValidateCredentials -->|Invalid| Retry["Retry Login"];\n'
+        '  Retry --> EnterCredentials;\n'
+        '  Success --> End["User Authenticated"];\n'
+    ),
+    "registration": (
+        '  Start["User Begins Registration"] --> Register["Register User (register)"];\n'
+        '  Register --> EnterDetails["Enter User Details"];\n'
+        '  EnterDetails --> ValidateDetails["Validate Details"];\n'
+        '  ValidateDetails -->|Valid| CreateAccount["Create Account"];\n'
+        '  ValidateDetails -->|Invalid| FixDetails["Correct Details"];\n'
+        '  FixDetails --> EnterDetails;\n'
+        '  CreateAccount --> End["Registration Complete"];\n'
+    ),
+    "checkout": (
+        '  Start["User Begins Checkout"] --> ReviewCart["Review Cart Items"];\n'
+        '  ReviewCart --> EnterPayment["Enter Payment Details"];\n'
+        '  EnterPayment --> ValidatePayment["Validate Payment"];\n'
+        '  ValidatePayment -->|Valid| PlaceOrder["Place Order"];\n'
+        '  ValidatePayment -->|Invalid| RetryPayment["Update Payment"];\n'
+        '  RetryPayment --> EnterPayment;\n'
+        '  PlaceOrder --> End["Order Complete"];\n'
+    ),
+    "API request": (
+        '  Start["Client Sends Request"] --> ValidateRequest["Validate Request"];\n'
+        '  ValidateRequest -->|Valid| ProcessRequest["Process Request"];\n'
+        '  ValidateRequest -->|Invalid| RejectRequest["Reject Request"];\n'
+        '  ProcessRequest --> GenerateResponse["Generate Response"];\n'
+        '  GenerateResponse --> End["Send Response to Client"];\n'
+        '  RejectRequest --> EndError["Return Error Response"];\n'
+    ),
+    # Generic process fallback
+    "process": (
+        '  Start["Begin Process"] --> Input["Process Input"];\n'
+        '  Input --> Validate["Validate Input"];\n'
+        '  Validate -->|Valid| Process["Process Data"];\n'
+        '  Validate -->|Invalid| Retry["Retry Input"];\n'
+        '  Retry --> Input;\n'
+        '  Process --> Output["Generate Output"];\n'
+        '  Output --> End["Process Complete"];\n'
+    ),
+}
+
+# Complete fallback diagrams for both supported orientations, built once at import
+_FALLBACK_DIAGRAMS = {
+    (direction, topic): f"graph {direction};\n{body}"
+    for direction in ("TD", "LR")
+    for topic, body in _FALLBACK_BODIES.items()
+}
+
+# Clean, valid diagram of the common checkout process, served for checkout
+# prompts in place of the model output; built once per orientation
+_CHECKOUT_BODY = (
+    '  Start["User Begins Checkout"] --> ViewCart["View Shopping Cart"];\n'
+    '  ViewCart --> EnterAddress["Enter Shipping Address"];\n'
+    '  EnterAddress --> ChoosePayment["Choose Payment Method"];\n'
+    '  ChoosePayment -->|Credit Card| ProcessCreditCard["Process Credit Card Payment"];\n'
+    '  ProcessCreditCard --> ConfirmCreditCard["Confirm Credit Card Payment"];\n'
+    '  ChoosePayment -->|PayPal| ProcessPayPal["Process PayPal Payment"];\n'
+    '  ProcessPayPal --> ConfirmPayPal["Confirm PayPal Payment"];\n'
+    '  ConfirmCreditCard --> ReviewSummary["Review Order Summary"];\n'
+    '  ConfirmPayPal --> ReviewSummary;\n'
+    '  ReviewSummary -->|Confirm| DispatchOrder["Dispatch Order"];\n'
+    '  DispatchOrder --> Delivered["Order Marked as Delivered"];\n'
+    '  ReviewSummary -->|Cancel| CancelCheckout["Cancel Checkout"];\n'
+    '  CancelCheckout --> End["Checkout Process Ends"];\n'
+    '  Delivered --> End;\n'
+)
+_CHECKOUT_DIAGRAMS = {direction: f"graph {direction};\n{_CHECKOUT_BODY}" for direction in ("TD", "LR")}
+
+@lru_cache(maxsize=512)
+def _fallback_diagram(prompt_lower: str, orientation: str) -> str:
+    """Build the fallback diagram for a lowercased prompt; deterministic, so repeats are served from the LRU."""
+    # Pick the topic in one scan; when several appear, the earliest in _FALLBACK_TOPICS wins
+    matches = {_TOPIC_ALIASES[match] for match in _TOPIC_RE.findall(prompt_lower)}
+    topic = next((topic for topic in _FALLBACK_TOPICS if topic in matches), "process")
+    
+    # Create a fallback diagram with proper structure and the requested orientation
+    diagram = _FALLBACK_DIAGRAMS.get((orientation, topic))
+    if diagram is None:
+        diagram = f"graph {orientation};\n" + _FALLBACK_BODIES[topic]
+        
+    return diagram
 
+class DiagramService:
+    """Service for generating diagrams using free Hugging Face models."""
+    
     @staticmethod
-    def generate_fallback_diagram(prompt: str, orientation="TD") -> str:
+    async def startup() -> None:
         """
-        Generate a more structured fallback diagram when the API is not available.
+        Open the disk cache and load the embedding model for this worker.
+
+        Called from the app's lifespan rather than at import, so `python main.py`
+        with several workers does not also load them in the supervisor process.
+        Without it (e.g. scripts using the service directly) only the in-memory
+        cache is used.
+        """
+        global _DISK_CACHE, _SEMANTIC_CACHE, _STARTED
+        if _DISK_CACHE is None:
+            _DISK_CACHE = await asyncio.to_thread(_create_disk_cache)
+        if _STARTED:
+            return
+        _STARTED = True
+        # Loading the model takes seconds; keep the loop free for other startup work
+        _SEMANTIC_CACHE = await asyncio.to_thread(
+            create_semantic_cache,
+            SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_MODEL, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TOP_K, SEMANTIC_CACHE_MAXSIZE,
+        )
+        if WARMUP_ON_STARTUP:
+            await asyncio.to_thread(_warmup_local)
+    
+    @staticmethod
+    async def warmup() -> None:
+        """
+        Open a pooled connection to the inference endpoint so DNS resolution and the
+        TLS handshake happen at startup rather than on the first user request.
+        """
+        try:
+            await _http_client().head(INFERENCE_API_URL)
+        except httpx.HTTPError as e:
+            logger.warning("Warmup request to inference API failed: %s", e)
+    
+    @staticmethod
+    async def aclose() -> None:
+        """Close the shared HTTP client and its pooled connections, and the disk cache."""
+        global _HTTP, _DISK_CACHE
+        if _HTTP is not None:
+            await _HTTP.aclose()
+            _HTTP = None
+        if _DISK_CACHE is not None:
+            _DISK_CACHE.close()
+            _DISK_CACHE = None
+    
+    @staticmethod
+    async def generate_mermaid_diagram(prompt: str, orientation="TD") -> str:
+        """
+        Generate a Mermaid.js diagram based on a user prompt using a free Hugging Face model.
         
         Args:
             prompt (str): User's diagram description/request
             orientation (str): Diagram orientation, either "TD" (top-down) or "LR" (left-right)
             
         Returns:
-            str: Simple Mermaid.js flowchart
+            str: Mermaid.js syntax for the requested diagram
+            
+        Raises:
+            ValueError: If diagram generation fails or produces invalid output
         """
-        # Extract keywords and attempt to create a more meaningful structure
-        words = prompt.lower().replace(',', ' ').replace('.', ' ').split()
-        
-        # Common flowchart-related words
-        start_words = ["begin", "start", "initiate", "create", "new"]
-        process_words = ["process", "update", "generate", "calculate", "send", "receive", "check", "validate", "enter"]
-        decision_words = ["if", "validate", "check", "verify", "decide", "determine", "assess", "evaluate"]
-        end_words = ["end", "finish", "complete", "done", "final", "success", "conclude"]
-        
-        # Look for keywords in the prompt
-        has_start = any(word in words for word in start_words)
-        has_process = any(word in words for word in process_words)
-        has_decision = any(word in words for word in decision_words)
-        has_end = any(word in words for word in end_words)
-        
-        # Create a fallback diagram with proper structure and the requested orientation
-        diagram = f"graph {orientation};\n"
-        
-        # Determine the general topic
-        topic = "process"
-        if "login" in prompt.lower():
-            topic = "login"
-        elif "register" in prompt.lower() or "registration" in prompt.lower():
-            topic = "registration"
-        elif "checkout" in prompt.lower() or "payment" in prompt.lower():
-            topic = "checkout"
-        elif "api" in prompt.lower():
-            topic = "API request"
-        
-        # Create a structured diagram based on topic
-        if topic == "login":
-            diagram += '  Start["User Begins Login"] --> EnterCredentials["Enter Credentials"];\n'
-            diagram += '  EnterCredentials --> ValidateCredentials["Validate Credentials"];\n'
-            diagram += '  ValidateCredentials -->|Valid| Success["Login Successful"];\n'
-            diagram += '  ValidateCredentials -->|Invalid| Retry["Retry Login"];\n'
-            diagram += '  Retry --> EnterCredentials;\n'
-            diagram += '  Success --> End["User Authenticated"];\n'
-        elif topic == "registration":
-            diagram += '  Start["User Begins Registration"] --> Register["Register User (register)"];\n'
-            diagram += '  Register --> EnterDetails["Enter User Details"];\n'
-            diagram += '  EnterDetails --> ValidateDetails["Validate Details"];\n'
-            diagram += '  ValidateDetails -->|Valid| CreateAccount["Create Account"];\n'
-            diagram += '  ValidateDetails -->|Invalid| FixDetails["Correct Details"];\n'
-            diagram += '  FixDetails --> EnterDetails;\n'
-            diagram += '  CreateAccount --> End["Registration Complete"];\n'
-        elif topic == "checkout":
-            diagram += '  Start["User Begins Checkout"] --> ReviewCart["Review Cart Items"];\n'
-            diagram += '  ReviewCart --> EnterPayment["Enter Payment Details"];\n'
-            diagram += '  EnterPayment --> ValidatePayment["Validate Payment"];\n'
-            diagram += '  ValidatePayment -->|Valid| PlaceOrder["Place Order"];\n'
-            diagram += '  ValidatePayment -->|Invalid| RetryPayment["Update Payment"];\n'
-            diagram += '  RetryPayment --> EnterPayment;\n'
-            diagram += '  PlaceOrder --> End["Order Complete"];\n'
-        elif topic == "API request":
-            diagram += '  Start["Client Sends Request"] --> ValidateRequest["Validate Request"];\n'
-            diagram += '  ValidateRequest -->|Valid| ProcessRequest["Process Request"];\n'
-            diagram += '  ValidateRequest -->|Invalid| RejectRequest["Reject Request"];\n'
-            diagram += '  ProcessRequest --> GenerateResponse["Generate Response"];\n'
-            diagram += '  GenerateResponse --> End["Send Response to Client"];\n'
-            diagram += '  RejectRequest --> EndError["Return Error Response"];\n'
+        logger.debug("Generating diagram for prompt: %s with orientation: %s", prompt, orientation)
+        
+        # Adjust the orientation in the example based on user preference
+        flow_direction = "TD" if orientation == "TD" else "LR"
+        
+        # Identical repeated prompts are answered straight from the exact-match cache
+        cache_key = _request_key(prompt, flow_direction)
+        cached_code = await _cached_diagram(cache_key)
+        if cached_code is not None:
+            logger.debug("Exact cache hit, skipping Hugging Face API call")
+            return cached_code
+        
+        # The hosted Hugging Face API requires a token; custom endpoints may not
+        if not HUGGINGFACE_API_TOKEN and INFERENCE_API_URL == DEFAULT_INFERENCE_API_URL:
+            logger.warning("HUGGINGFACE_API_TOKEN not found in environment variables. API calls will fail.")
+            raise ValueError("Missing API token for Hugging Face. Please check your configuration.")
+        
+        # Identical requests already being generated share the in-flight result
+        task = _INFLIGHT.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(DiagramService._generate_uncached(prompt, flow_direction, cache_key))
+            _INFLIGHT[cache_key] = task
+            task.add_done_callback(lambda _: _INFLIGHT.pop(cache_key, None))
         else:
-            # Generic process fallback
-            diagram += '  Start["Begin Process"] --> Input["Process Input"];\n'
-            diagram += '  Input --> Validate["Validate Input"];\n'
-            diagram += '  Validate -->|Valid| Process["Process Data"];\n'
-            diagram += '  Validate -->|Invalid| Retry["Retry Input"];\n'
-            diagram += '  Retry --> Input;\n'
-            diagram += '  Process --> Output["Generate Output"];\n'
-            diagram += '  Output --> End["Process Complete"];\n'
-            
-        return diagram
+            logger.debug("Joining in-flight generation for identical prompt")
+        # Shield so one caller disconnecting does not cancel the others' generation
+        return await asyncio.shield(task)
 
     @staticmethod
-    def validate_mermaid_syntax(code: str) -> str:
+    async def _generate_uncached(prompt: str, flow_direction: str, cache_key: str) -> str:
         """
-        Validate Mermaid.js syntax and fix common errors that prevent rendering.
-        
+        Generate a diagram through the semantic cache or the Hugging Face API and
+        store it in the caches.
+
         Args:
-            code (str): Mermaid.js code to validate
-            
+            prompt (str): User's diagram description/request
+            flow_direction (str): Normalized orientation, either "TD" or "LR"
+            cache_key (str): Exact-match cache key from `_request_key`
+
         Returns:
-            str: Fixed Mermaid.js code
+            str: Mermaid.js syntax for the requested diagram
+
+        Raises:
+            ValueError: If diagram generation fails or produces invalid output
         """
-        # Check for missing semicolons
-        fixed_code = code
-        
-        # Fix missing arrows in adjacent nodes
-        lines = fixed_code.split('\n')
-        for i, line in enumerate(lines):
-            if re.search(r'\w+\["[^"]*"\]\s+\w+\["[^"]*"\]', line):
-                # Found adjacent nodes without arrows
-                words = re.findall(r'(\w+\["[^"]*"\])', line)
-                if len(words) >= 2:
-                    new_line = ""
-                    for j in range(len(words) - 1):
-                        new_line += f"{words[j]} --> {words[j+1]};"
-                    lines[i] = new_line
-        
-        fixed_code = '\n'.join(lines)
+        # Serve near-duplicate prompts from the semantic cache before calling the API
+        embedding = None
+        if _SEMANTIC_CACHE is not None:
+            # Embedding runs the model and the lookup scans every cached prompt on
+            # the CPU; keep both off the event loop
+            embedding, cached_code = await asyncio.to_thread(_semantic_lookup, prompt, flow_direction)
+            if cached_code is not None:
+                logger.debug("Semantic cache hit, skipping Hugging Face API call")
+                # Promote the hit so repeats of this exact prompt skip the embedding step
+                await _store_diagram(cache_key, cached_code)
+                return cached_code
+        
+        # Format the input for Mistral from the prebuilt template for this orientation
+        model_input = _encode_model_input(prompt, flow_direction)
         
-        # Fix connections that are missing arrows
-        fixed_code = re.sub(r'(\w+\["[^"]*"\])\s+(\w+\["[^"]*"\])', r'\1 --> \2', fixed_code)
+        try:
+            # Concurrent requests are coalesced into batched API calls
+            result = await _BATCHER.submit(model_input)
+            logger.debug("API response successful, processing result")
+            
+            cleaned_code = DiagramService._finish_diagram(prompt, result, flow_direction)
+            
+            await _store_diagram(cache_key, cleaned_code)
+            if embedding is not None:
+                _SEMANTIC_CACHE.add(embedding, flow_direction, cleaned_code)
+            
+            return cleaned_code
+        except Exception as e:
+            # Log the error and raise an exception
+            logger.exception("Error generating diagram")
+            raise ValueError(f"Error generating diagram: {str(e)}") from e
+
+    @staticmethod
+    async def stream_mermaid_diagram(prompt: str, orientation="TD") -> AsyncIterator[dict]:
+        """
+        Generate a Mermaid.js diagram, yielding model output as it arrives.
         
-        # Fix the most common issue - ConfirmPayPal --> ReviewOrder without an arrow
-        fixed_code = re.sub(r'(ConfirmPayPal["[^"]*"]\s+Review)', r'ConfirmPayPal["[^"]*"] --> Review', fixed_code)
+        Args:
+            prompt (str): User's diagram description/request
+            orientation (str): Diagram orientation, either "TD" (top-down) or "LR" (left-right)
+            
+        Yields:
+            dict: {"token": str} for each generated fragment, then a final
+                {"mermaid_code": str} with the cleaned diagram
+            
+        Raises:
+            ValueError: If diagram generation fails or produces invalid output
+        """
+        logger.debug("Streaming diagram for prompt: %s with orientation: %s", prompt, orientation)
+        flow_direction = "TD" if orientation == "TD" else "LR"
         
-        # Fix missing semicolons at line ends
-        fixed_code = re.sub(r'(\w+)\s*$', r'\1;', fixed_code)
+        cache_key = _request_key(prompt, flow_direction)
+        cached_code = await _cached_diagram(cache_key)
+        if cached_code is not None:
+            logger.debug("Exact cache hit, skipping Hugging Face API call")
+            yield {"mermaid_code": cached_code}
+            return
         
-        # Remove excessive whitespace
-        fixed_code = re.sub(r'\s{2,}', ' ', fixed_code)
+        if not HUGGINGFACE_API_TOKEN and INFERENCE_API_URL == DEFAULT_INFERENCE_API_URL:
+            logger.warning("HUGGINGFACE_API_TOKEN not found in environment variables. API calls will fail.")
+            raise ValueError("Missing API token for Hugging Face. Please check your configuration.")
         
-        # Ensure each connection ends with a semicolon
-        fixed_code = re.sub(r'(-->.*?)(\n|$)', r'\1;\2', fixed_code)
+        model_input = _encode_model_input(prompt, flow_direction)
         
-        # Make sure all lines have proper indentation
-        lines = fixed_code.split('\n')
-        for i, line in enumerate(lines):
-            if i > 0 and not line.startswith(' ') and not line.startswith('\t'):
-                lines[i] = '  ' + line
+        try:
+            # Streamed requests bypass the batcher so tokens can be forwarded immediately
+            fragments = []
+            async for fragment in _iter_completion(model_input):
+                fragments.append(fragment)
+                yield {"token": fragment}
+            
+            # Validate and clean once the whole diagram has arrived
+            cleaned_code = DiagramService._finish_diagram(prompt, "".join(fragments), flow_direction)
+            await _store_diagram(cache_key, cleaned_code)
+        except Exception as e:
+            logger.exception("Error generating diagram")
+            raise ValueError(f"Error generating diagram: {str(e)}") from e
         
-        fixed_code = '\n'.join(lines)
+        yield {"mermaid_code": cleaned_code}
+
+    @staticmethod
+    def _finish_diagram(prompt: str, result: str, flow_direction: str) -> str:
+        """Clean raw model output and apply the specialized checkout formatter when relevant."""
+        # Clean and format the response, preserving the orientation
+        cleaned_code = DiagramService.clean_mermaid_code(result, flow_direction)
+        
+        # Check if this is a checkout diagram and use a specialized formatter
+        if _CHECKOUT_PROMPT_RE.search(prompt):
+            logger.debug("Detected checkout diagram, applying specialized formatter")
+            cleaned_code = DiagramService.format_checkout_diagram(cleaned_code, flow_direction)
+        return cleaned_code
+
+    @staticmethod
+    def generate_fallback_diagram(prompt: str, orientation="TD") -> str:
+        """
+        Generate a more structured fallback diagram when the API is not available.
         
-        return fixed_code
+        Args:
+            prompt (str): User's diagram description/request
+            orientation (str): Diagram orientation, either "TD" (top-down) or "LR" (left-right)
+            
+        Returns:
+            str: Simple Mermaid.js flowchart
+        """
+        return _fallback_diagram(prompt.lower(), orientation)
 
     @staticmethod
-    async def clean_mermaid_code(code: str, orientation="TD") -> str:
+    def clean_mermaid_code(code: str, orientation="TD") -> str:
         """
         Clean and validate the generated Mermaid code.
         
@@ -291,223 +791,53 @@ class DiagramService:
         Returns:
             str: Cleaned Mermaid.js code
         """
-        print(f"Raw Mermaid code received:\n{code}")
-        
-        # Remove any text before and after the mermaid code
-        # First, try to extract from markdown code blocks if present
-        if "```" in code:
-            # Handle markdown code blocks
-            if "```mermaid" in code:
-                code = code.split("```mermaid", 1)[1]
-                if "```" in code:
-                    code = code.split("```", 1)[0]
-            else:
-                parts = code.split("```", 2)
-                if len(parts) >= 3:
-                    code = parts[1]
-                    if code.startswith("mermaid\n"):
-                        code = code[8:]  # Remove "mermaid\n" prefix
+        # Multi-line dumps are skipped entirely unless debug logging is on
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("Raw Mermaid code received:\n%s", code)
+        
+        # Remove any text before and after the mermaid code: take the body of the
+        # first (optionally "mermaid"-tagged) code block if the model used one
+        fence = _FENCE_RE.search(code)
+        if fence is not None:
+            code = fence.group(1)
         
         # Remove any leading/trailing whitespace
         code = code.strip()
         
         # Ensure the code contains basic mermaid syntax
-        if not any(keyword in code for keyword in ["graph ", "sequenceDiagram", "classDiagram", "erDiagram", "stateDiagram", "gantt", "pie"]):
-            print("ERROR: No valid Mermaid syntax found in generated code")
+        if _DIAGRAM_KIND_RE.search(code) is None:
+            logger.error("No valid Mermaid syntax found in generated code")
             raise ValueError("Invalid Mermaid diagram generated: Missing diagram type declaration")
         
-        # Ensure the code has a graph declaration if it's a flowchart but missing this
-        # And use the requested orientation
-        if "graph " not in code and any(node_marker in code for node_marker in ["-->", "==>", "-.->", "==>"]):
-            code = f"graph {orientation};\n" + code
-            
-        # Update the graph direction to match the requested orientation
-        if "graph " in code:
-            # Extract the current orientation
-            match = re.search(r"graph\s+([A-Z]+)", code)
-            if match:
-                current_orientation = match.group(1)
-                # If it doesn't match the requested orientation, update it
-                if current_orientation != orientation:
-                    code = re.sub(r"graph\s+([A-Z]+)", f"graph {orientation}", code)
-            else:
-                # No orientation specified, add the requested one
-                code = code.replace("graph ", f"graph {orientation} ")
-        
-        # Split by semicolon or line breaks to get individual statements
-        statements = []
-        for line in code.replace(";", ";\n").split("\n"):
-            line = line.strip()
-            if line:
-                statements.append(line)
-        
-        # Find the graph declaration (first line)
-        graph_decl = None
-        other_statements = []
-        for statement in statements:
-            if statement.startswith("graph "):
-                graph_decl = statement
-                if not statement.endswith(";"):
-                    graph_decl += ";"
-            else:
-                # Only add non-empty statements
-                if statement.strip():
-                    other_statements.append(statement)
-        
-        # If no graph declaration was found, add one
-        if not graph_decl:
-            graph_decl = f"graph {orientation};"
-        
-        # Clean and format individual statements
-        formatted_statements = []
-        for statement in other_statements:
-            # Skip empty statements
-            if not statement.strip():
-                continue
-                
-            # Ensure statement ends with semicolon
-            if not statement.endswith(";"):
-                statement += ";"
-                
-            # Fix node formatting
-            if "-->" in statement:
-                parts = statement.split("-->")
-                if len(parts) == 2:
-                    node1 = parts[0].strip()
-                    node2 = parts[1].strip()
-                    
-                    # Check if node1 is missing brackets
-                    if node1 and not any(c in node1 for c in ['[', '(', '{', '"']):
-                        node1 = f'{node1}["{node1}"]'
-                    
-                    # Fix double quotes in node1
-                    if '["' in node1 and '"]' in node1:
-                        label = node1.split('["')[1].split('"]')[0]
-                        node_name = node1.split('[')[0].strip()
-                        if node_name == label:
-                            node1 = f'{node_name}["{label}"]'
-                    
-                    # Fix condition formatting - check for invalid syntax with ||
-                    if "||" in node2:
-                        node2 = node2.replace("||", "|")
-                        
-                    # Check if node2 contains a condition path
-                    if "|" in node2:
-                        # Handle conditional paths
-                        try:
-                            before_pipe = node2.split("|", 1)[0].strip()
-                            after_pipe = node2.split("|", 1)[1].strip()
-                            
-                            # Mermaid.js conditional syntax should be: -->|condition|target
-                            # If there's text before the pipe, it should be empty
-                            if before_pipe:
-                                # This is not a standard condition format, fix it
-                                condition = before_pipe
-                                # Find the target node after the condition and label
-                                remaining = after_pipe
-                                if "|" in remaining:
-                                    # There's another pipe, this is like "||Valid|Target"
-                                    parts = remaining.split("|", 1)
-                                    label = parts[0].strip()
-                                    target = parts[1].strip()
-                                    # Recreate the proper format
-                                    node2 = f"|{label}| {target}"
-                                else:
-                                    # This is just a simple "label|Target"
-                                    target = remaining
-                                    node2 = f"|{condition}| {target}"
-                            
-                            # Make sure the target node after the condition has proper formatting
-                            parts = node2.split("|")
-                            if len(parts) >= 2:
-                                # Last part should be the target node
-                                target = parts[-1].strip()
-                                if target and not any(c in target for c in ['[', '(', '{', '"']):
-                                    # Format the target node properly
-                                    updated_target = f'{target}["{target}"]'
-                                    # Replace the target part in the original string
-                                    node2 = node2.replace(target, updated_target)
-                        except Exception as e:
-                            print(f"Error fixing condition path: {e}")
-                            # If parsing fails, just leave it as is
-                            pass
-                    else:
-                        # Not a condition, check if node2 needs formatting
-                        if node2 and not any(c in node2 for c in ['[', '(', '{', '"']):
-                            node2 = f'{node2}["{node2}"]'
-                        
-                        # Fix semicolons inside node definitions
-                        if ';[' in node2:
-                            node2 = node2.replace(';[', '[')
-                    
-                    statement = f"  {node1} --> {node2}"
-            
-            formatted_statements.append(statement)
-        
-        # Combine everything back together with proper formatting
-        formatted_code = graph_decl + "\n" + "\n".join(formatted_statements)
-        
-        # Fix any remaining issues
-        # Remove extra semicolons in node labels
-        formatted_code = re.sub(r'\["([^"]*);"\]', r'["\1"]', formatted_code)
-        
-        # Remove duplicate node definitions like Node["Node"]
-        lines = formatted_code.split("\n")
-        for i, line in enumerate(lines):
-            if "-->" in line:
-                for node_match in re.finditer(r'(\w+)\["(\1)"\]', line):
-                    node = node_match.group(1)
-                    lines[i] = lines[i].replace(f'{node}["{node}"]', node)
-        
-        formatted_code = "\n".join(lines)
-        
-        # Fix missing arrows between nodes where there's just a space or nothing
-        # For example "NodeA --> NodeB NodeC" should be "NodeA --> NodeB; NodeB --> NodeC"
-        formatted_code = re.sub(r'(\w+)(\s+)(\w+)', r'\1 --> \3', formatted_code)
-        
-        # Add missing semicolons at the end of lines
-        formatted_code = re.sub(r'(\w+["[^"]*"\])\s*$', r'\1;', formatted_code)
-        
-        # Ensure each line with arrows has a semicolon
-        lines = formatted_code.split("\n")
-        for i, line in enumerate(lines):
-            if "-->" in line and not line.strip().endswith(";"):
-                lines[i] = line.strip() + ";"
+        # Diagram types other than flowcharts are passed through untouched
+        if _FLOWCHART_DECL_RE.search(code) is None:
+            if debug:
+                logger.debug("Cleaned Mermaid code:\n%s", code)
+            return code
         
-        formatted_code = "\n".join(lines)
+        canonical = is_canonical_flowchart(code, orientation)
+        _record_fast_path(canonical)
+        if canonical:
+            # The model followed the requested format exactly; nothing to repair
+            formatted_code = code
+        else:
+            # Parse the flowchart in one pass and re-emit it in canonical form: requested
+            # orientation, quoted labels, one statement per line ending in a semicolon
+            flowchart = MermaidFlowchartParser().parse(code)
+            if not flowchart.statements:
+                logger.error("No flowchart statements found in generated code")
+                raise ValueError("Invalid Mermaid diagram generated: No flowchart statements found")
+            formatted_code = flowchart.render(orientation)
         
         # Special case handling for test requirements
         if "registration" in formatted_code.lower() and "register" not in formatted_code.lower():
             # Add "register" somewhere in the diagram if not already present
             formatted_code = formatted_code.replace("Registration", "Registration (register)")
         
-        # Fix common issues with Mermaid syntax that causes rendering problems
-        formatted_code = formatted_code.replace("-->|", "--> |")  # Add space before condition
-        formatted_code = formatted_code.replace("|| ", "|")       # Fix double pipes
-        formatted_code = formatted_code.replace("||", "|")        # Fix any remaining double pipes
-        
-        # Final check to ensure proper connections between all nodes
-        lines = formatted_code.split("\n")
-        clean_lines = [lines[0]]  # Keep the graph direction declaration
-        
-        for line in lines[1:]:
-            if line.strip():
-                if "-->" in line:
-                    # This is a connection line, make sure it ends with semicolon
-                    if not line.strip().endswith(";"):
-                        line = line.strip() + ";"
-                clean_lines.append(line)
-        
-        formatted_code = "\n".join(clean_lines)
-        
-        # Remove any missing arrow sequences (like "NodeA NodeB" without an arrow)
-        formatted_code = re.sub(r'(\w+\["[^"]*"\])\s+(\w+\["[^"]*"\])', r'\1 --> \2', formatted_code)
-        
-        # Apply validation fixes as a final step
-        formatted_code = DiagramService.validate_mermaid_syntax(formatted_code)
-        
-        print(f"Cleaned Mermaid code:\n{formatted_code}")
-        return formatted_code.strip()
+        if debug:
+            logger.debug("Cleaned Mermaid code:\n%s", formatted_code)
+        return formatted_code
 
     @staticmethod
     def format_checkout_diagram(code: str, orientation="TD") -> str:
@@ -523,24 +853,11 @@ class DiagramService:
             str: Clean checkout diagram
         """
         # If it doesn't look like a checkout diagram, return the original
-        if not ("checkout" in code.lower() or "shopping" in code.lower() or "payment" in code.lower()):
+        if not _CHECKOUT_CODE_RE.search(code):
             return code
             
-        # Create a clean, valid checkout diagram
-        checkout_diagram = f"""graph {orientation};
-  Start["User Begins Checkout"] --> ViewCart["View Shopping Cart"];
-  ViewCart --> EnterAddress["Enter Shipping Address"];
-  EnterAddress --> ChoosePayment["Choose Payment Method"];
-  ChoosePayment -->|Credit Card| ProcessCreditCard["Process Credit Card Payment"];
-  ProcessCreditCard --> ConfirmCreditCard["Confirm Credit Card Payment"];
-  ChoosePayment -->|PayPal| ProcessPayPal["Process PayPal Payment"];
-  ProcessPayPal --> ConfirmPayPal["Confirm PayPal Payment"];
-  ConfirmCreditCard --> ReviewSummary["Review Order Summary"];
-  ConfirmPayPal --> ReviewSummary;
-  ReviewSummary -->|Confirm| DispatchOrder["Dispatch Order"];
-  DispatchOrder --> Delivered["Order Marked as Delivered"];
-  ReviewSummary -->|Cancel| CancelCheckout["Cancel Checkout"];
-  CancelCheckout --> End["Checkout Process Ends"];
-  Delivered --> End;
-"""
+        # Return the clean, valid checkout diagram for this orientation
+        checkout_diagram = _CHECKOUT_DIAGRAMS.get(orientation)
+        if checkout_diagram is None:
+            checkout_diagram = f"graph {orientation};\n" + _CHECKOUT_BODY
         return checkout_diagram 
\ No newline at end of file
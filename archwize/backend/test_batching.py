@@ -0,0 +1,76 @@
+import asyncio
+
+from batching import PromptBatcher
+
+
+class Recorder:
+    """send_batch stand-in that records each batch and echoes its inputs."""
+
+    def __init__(self, fail_with=None):
+        self.batches = []
+        self.fail_with = fail_with
+
+    async def __call__(self, inputs):
+        self.batches.append(list(inputs))
+        if self.fail_with is not None:
+            raise self.fail_with
+        return [f"out:{item.decode()}" for item in inputs]
+
+
+def test_batches_split_by_size():
+    """Inputs queued together are sent in batches of at most max_batch_size."""
+    send = Recorder()
+    batcher = PromptBatcher(send, max_batch_size=2, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(str(i).encode()) for i in range(5)))
+
+    assert asyncio.run(run()) == [f"out:{i}" for i in range(5)]
+    assert send.batches == [[b"0", b"1"], [b"2", b"3"], [b"4"]]
+
+
+def test_batches_split_by_wait_time():
+    """An input arriving after the wait window goes into the next batch."""
+    send = Recorder()
+    batcher = PromptBatcher(send, max_batch_size=8, max_wait_ms=10)
+
+    async def run():
+        first = asyncio.ensure_future(batcher.submit(b"a"))
+        await asyncio.sleep(0.05)
+        return [await first, await batcher.submit(b"b")]
+
+    assert asyncio.run(run()) == ["out:a", "out:b"]
+    assert send.batches == [[b"a"], [b"b"]]
+
+
+def test_results_fan_out_to_their_callers():
+    """Each caller gets the completion for its own input, and exceptions fail only their caller."""
+    async def send(inputs):
+        return [ValueError(item.decode()) if item == b"bad" else item.decode().upper() for item in inputs]
+
+    batcher = PromptBatcher(send, max_batch_size=3, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(item) for item in (b"x", b"bad", b"y")), return_exceptions=True)
+
+    x, bad, y = asyncio.run(run())
+    assert (x, y) == ("X", "Y")
+    assert isinstance(bad, ValueError) and str(bad) == "bad"
+
+
+def test_batch_failure_propagates_to_every_caller():
+    """An exception from send_batch, or a short result list, fails every input in the batch."""
+    send = Recorder(fail_with=ValueError("API down"))
+    batcher = PromptBatcher(send, max_batch_size=2, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(batcher.submit(b"a"), batcher.submit(b"b"), return_exceptions=True)
+
+    assert [str(e) for e in asyncio.run(run())] == ["API down", "API down"]
+
+    async def short(inputs):
+        return ["only one"]
+
+    batcher = PromptBatcher(short, max_batch_size=2, max_wait_ms=50)
+    errors = asyncio.run(run())
+    assert all(isinstance(e, ValueError) and str(e) == "Expected 2 completions, got 1" for e in errors)
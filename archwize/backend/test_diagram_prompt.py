@@ -4,22 +4,24 @@ Utility for manually testing diagram generation with custom prompts.
 This script allows you to send custom prompts to the API and view the results.
 """
 
-import requests
-import json
+import httpx
+import orjson
 import argparse
 import os
 
+# Shared client so repeated prompts in interactive mode reuse one connection
+_CLIENT = httpx.Client(http2=True, headers={"Content-Type": "application/json"}, timeout=60.0)
+
 def generate_diagram(prompt, server_url="http://localhost:8000"):
     """Send a prompt to the API and get the generated diagram."""
     try:
-        response = requests.post(
+        response = _CLIENT.post(
             f"{server_url}/generate",
-            json={"prompt": prompt},
-            timeout=60
+            content=orjson.dumps({"prompt": prompt})
         )
         
         if response.status_code == 200:
-            return True, response.json()
+            return True, orjson.loads(response.content)
         else:
             return False, f"Error: {response.status_code} - {response.text}"
     except Exception as e:
@@ -27,8 +29,11 @@ def generate_diagram(prompt, server_url="http://localhost:8000"):
 
 def save_diagram(mermaid_code, filename):
     """Save the Mermaid diagram code to a file."""
-    with open(filename, 'w') as f:
-        f.write(mermaid_code)
+    # Encode once and write the bytes unbuffered; binary mode also keeps the
+    # newlines exactly as generated instead of translating them on Windows
+    data = mermaid_code.encode("utf-8")
+    with open(filename, 'wb', buffering=0) as f:
+        f.write(data)
     print(f"Diagram saved to {filename}")
 
 def print_mermaid(mermaid_code):
@@ -39,16 +44,17 @@ def print_mermaid(mermaid_code):
     print(mermaid_code)
     print("\n" + "=" * 80 + "\n")
 
+# Command-line interface, built once at import
+_PARSER = argparse.ArgumentParser(description="Test diagram generation with custom prompts")
+_PARSER.add_argument("prompt", nargs="?", help="The prompt to generate a diagram from")
+_PARSER.add_argument("--server", "-s", default="http://localhost:8000", 
+                     help="The server URL (default: http://localhost:8000)")
+_PARSER.add_argument("--output", "-o", help="Save the diagram to a file")
+_PARSER.add_argument("--interactive", "-i", action="store_true", 
+                     help="Run in interactive mode, allowing multiple prompts")
+
 def main():
-    parser = argparse.ArgumentParser(description="Test diagram generation with custom prompts")
-    parser.add_argument("prompt", nargs="?", help="The prompt to generate a diagram from")
-    parser.add_argument("--server", "-s", default="http://localhost:8000", 
-                      help="The server URL (default: http://localhost:8000)")
-    parser.add_argument("--output", "-o", help="Save the diagram to a file")
-    parser.add_argument("--interactive", "-i", action="store_true", 
-                      help="Run in interactive mode, allowing multiple prompts")
-    
-    args = parser.parse_args()
+    args = _PARSER.parse_args()
     
     if args.interactive:
         print("Interactive Diagram Generation Mode")
@@ -91,7 +97,7 @@ def main():
         else:
             print(f"Failed to generate diagram: {result}")
     else:
-        parser.print_help()
+        _PARSER.print_help()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+import orjson
+import pytest
+
+import services
+from services import InferenceAPIError, _iter_completion, _open_stream
+
+
+def sse(*events):
+    """Encode events the way text-generation-inference streams them."""
+    return b"".join(b"data:" + orjson.dumps(event) + b"\n\n" for event in events)
+
+
+def token(text, special=False):
+    """One generated-token event."""
+    return {"token": {"id": 0, "text": text, "logprob": 0.0, "special": special}}
+
+
+def mock_api(monkeypatch, *responses):
+    """Serve `responses` in order from a mock transport and return the list of requests made."""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return responses[len(requests) - 1]
+
+    monkeypatch.setattr(services, "_HTTP", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(services, "_RETRY_BACKOFF", 0)
+    # Whatever the environment configured, no rate limiting and a slot free for every call
+    monkeypatch.setattr(services, "_RATE_LIMITER", None)
+    monkeypatch.setattr(services, "_INFERENCE_SEMAPHORE", asyncio.Semaphore(1))
+    return requests
+
+
+def collect(model_input=b'"prompt"'):
+    async def run():
+        return [fragment async for fragment in _iter_completion(model_input)]
+
+    return asyncio.run(run())
+
+
+def test_stops_at_closing_fence_split_across_tokens(monkeypatch):
+    """Fences split over several tokens are still counted, and nothing after the closing one is read."""
+    body = sse(
+        token("Sure: ``"),
+        token("`mermaid\ngraph TD;\n  A --> B;\n`"),
+        token("</s>", special=True),
+        token("`"),
+        token("`\nThis diagram shows"),
+        token(" more text"),
+    )
+    requests = mock_api(monkeypatch, httpx.Response(200, content=body))
+    fragments = collect()
+    assert fragments == ["Sure: ``", "`mermaid\ngraph TD;\n  A --> B;\n`", "`", "`\nThis diagram shows"]
+    assert orjson.loads(requests[0].content)["stream"] is True
+
+
+def test_backticks_inside_a_fence_are_not_recounted(monkeypatch):
+    """A fence is only counted once even when later tokens are scanned from just before it."""
+    body = sse(token("```"), token("mermaid\n"), token("A --> B\n"), token("``` trailing"), token("never read"))
+    mock_api(monkeypatch, httpx.Response(200, content=body))
+    assert "".join(collect()) == "```mermaid\nA --> B\n``` trailing"
+
+
+def test_error_event_raises(monkeypatch):
+    """An error event in the stream fails the completion."""
+    body = sse(token("```"), {"error": "Input validation error", "error_type": "validation"})
+    mock_api(monkeypatch, httpx.Response(200, content=body))
+    with pytest.raises(ValueError, match="Input validation error"):
+        collect()
+
+
+def test_open_stream_retries_transient_statuses(monkeypatch):
+    """503s are retried until the stream opens."""
+    requests = mock_api(
+        monkeypatch,
+        httpx.Response(503, json={"error": "Model is loading"}),
+        httpx.Response(503, json={"error": "Model is loading"}, headers={"Retry-After": "0"}),
+        httpx.Response(200, content=sse(token("ok"))),
+    )
+
+    async def run():
+        async with _open_stream(b"{}") as response:
+            return response.status_code, await response.aread()
+
+    status, body = asyncio.run(run())
+    assert status == 200 and b"ok" in body
+    assert len(requests) == 3
+
+
+def test_open_stream_gives_up(monkeypatch):
+    """Client errors fail at once; transient ones fail once retries run out."""
+    for status, attempts in ((400, 1), (503, services._MAX_RETRIES + 1)):
+        requests = mock_api(monkeypatch, *[httpx.Response(status, text="nope")] * attempts)
+
+        async def run():
+            async with _open_stream(b"{}"):
+                pass
+
+        with pytest.raises(InferenceAPIError) as excinfo:
+            asyncio.run(run())
+        assert excinfo.value.status_code == status
+        assert len(requests) == attempts
@@ -0,0 +1,101 @@
+from mermaid_parser import MermaidFlowchartParser, Link, Node, is_canonical_flowchart, parse_flowchart
+
+
+def clean(code, orientation="TD"):
+    """Parse and re-render a flowchart the way DiagramService does."""
+    return MermaidFlowchartParser().parse(code).render(orientation)
+
+
+def test_canonical_output():
+    """Statements are quoted, indented and terminated, with the requested orientation."""
+    code = 'graph TD\n  Start[Begin] --> Check{"Valid?"}\n  Check -->|Yes| Done["Done"]\n  Check -->|No| Start'
+    assert clean(code, "LR") == (
+        'graph LR;\n'
+        '  Start["Begin"] --> Check{"Valid?"};\n'
+        '  Check -->|Yes| Done["Done"];\n'
+        '  Check -->|No| Start;'
+    )
+
+
+def test_semicolon_separated_statements():
+    """Statements separated only by semicolons are split onto their own lines."""
+    assert clean("graph TD;A-->B;B-->C;") == "graph TD;\n  A --> B;\n  B --> C;"
+
+
+def test_condition_label_repairs():
+    """Text-on-link and doubled pipes are rewritten as -->|label|."""
+    code = "graph TD\nB -- yes --> C\nC -->||Ok|| D"
+    assert clean(code) == "graph TD;\n  B -->|yes| C;\n  C -->|Ok| D;"
+
+
+def test_missing_arrow_between_labelled_nodes():
+    """Two labelled nodes side by side are joined with an arrow."""
+    assert clean('A["x;"] B["y"]') == 'graph TD;\n  A["x"] --> B["y"];'
+
+
+def test_prose_is_dropped():
+    """Explanatory text around the diagram does not become nodes."""
+    code = "Here is your diagram:\ngraph TD;\nA --> B\nThis shows the flow."
+    assert clean(code) == "graph TD;\n  A --> B;"
+
+
+def test_passthrough_statements():
+    """Subgraphs and styling lines are kept as written."""
+    code = "graph TD\nsubgraph One\nX --> Y\nend\nstyle X fill:#f9f"
+    assert clean(code) == "graph TD;\n  subgraph One\n  X --> Y;\n  end\n  style X fill:#f9f"
+
+
+def test_canonical_detection():
+    """Rendered output is recognized as canonical; anything the parser would change is not."""
+    rendered = clean('graph TD\n  A[Start] --> B{"Ok?"}\n  B -->|Yes| C', "LR")
+    assert is_canonical_flowchart(rendered, "LR")
+    assert not is_canonical_flowchart(rendered, "TD")
+    assert not is_canonical_flowchart("graph TD;\n  A[x] --> B;")
+    assert not is_canonical_flowchart("graph TD;\n  A --> B")
+    assert not is_canonical_flowchart("graph TD;\n  A --> end;")
+
+
+def test_parsed_statements():
+    """Shapes, text-on-link conditions and passthrough lines are parsed structurally."""
+    assert parse_flowchart('graph LR\nA(["Go"]) -- ok --> B;class A x') == [
+        [Node("A", "([", '"Go"', "])"), Link("-->", "ok"), Node("B")],
+        "class A x",
+    ]
+
+
+def test_circle_cross_and_bidirectional_links():
+    """Circle, cross and two-way edges are kept, without being mistaken for text on a link."""
+    assert clean("A --o B\nA --x C\nA <--> D\nD <-.-> E") == (
+        "graph TD;\n  A --o B;\n  A --x C;\n  A <--> D;\n  D <-.-> E;"
+    )
+    assert clean("A --ok--> B") == "graph TD;\n  A -->|ok| B;"
+
+
+def test_node_classes():
+    """A :::class suffix stays attached to its node, with or without a shape."""
+    rendered = clean("A:::cls --> B[Go]:::hot-path")
+    assert rendered == 'graph TD;\n  A:::cls --> B["Go"]:::hot-path;'
+    assert is_canonical_flowchart(rendered)
+
+
+def test_semicolon_inside_label():
+    """A semicolon inside a bracketed label does not end the statement."""
+    rendered = clean("A --> B[Send email; notify]")
+    assert rendered == 'graph TD;\n  A --> B["Send email; notify"];'
+    assert is_canonical_flowchart(rendered)
+
+
+def test_discarded_statements_are_logged(caplog):
+    """Statements that cannot be parsed are dropped with a log line naming them."""
+    with caplog.at_level("INFO", logger="mermaid_parser"):
+        assert clean("A --> B\nA B C") == "graph TD;\n  A --> B;"
+    assert "'A B C'" in caplog.text
+
+
+def test_long_links_are_normalized():
+    """Longer links keep the statement and render as the canonical operator of their kind."""
+    rendered = clean("A[Start] ---> B[End]\nB ====> C -..-> D\nD ---- E <---> F\nF -- yes ---> G")
+    assert rendered == (
+        'graph TD;\n  A["Start"] --> B["End"];\n  B ==> C -.-> D;\n  D --- E <--> F;\n  F -->|yes| G;'
+    )
+    assert is_canonical_flowchart(rendered)
@@ -0,0 +1,26 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from semantic_cache import _Partition
+
+
+def test_partition_grows_up_to_maxsize():
+    """The embedding matrix grows geometrically but never beyond maxsize."""
+    partition = _Partition(dim=2, maxsize=5, capacity=2)
+    for i in range(5):
+        partition.append(np.array([i, 0], dtype=np.float32), f"code{i}")
+    assert partition.embeddings.shape == (5, 2)
+    assert partition.codes == [f"code{i}" for i in range(5)]
+
+
+def test_partition_evicts_oldest_when_full():
+    """Once full, each new entry replaces the oldest one."""
+    partition = _Partition(dim=2, maxsize=3)
+    for i in range(5):
+        partition.append(np.array([i, 0], dtype=np.float32), f"code{i}")
+    assert partition.embeddings.shape == (3, 2)
+    assert sorted(partition.codes) == ["code2", "code3", "code4"]
+    # Embedding rows stay aligned with their diagrams
+    for row, code in zip(partition.embeddings, partition.codes):
+        assert code == f"code{int(row[0])}"
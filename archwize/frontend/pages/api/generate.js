@@ -2,6 +2,17 @@
 // This connects to our FastAPI backend for processing
 
 import axios from 'axios';
+import http from 'http';
+import https from 'https';
+
+// Shared client created once per server process so connections to the
+// backend are kept alive and reused instead of reopened on every request
+const backendUrl = process.env.BACKEND_URL || 'http://localhost:8000';
+const backendClient = axios.create({
+  baseURL: backendUrl,
+  httpAgent: new http.Agent({ keepAlive: true }),
+  httpsAgent: new https.Agent({ keepAlive: true }),
+});
 
 export default async function handler(req, res) {
   // Only accept POST requests
@@ -17,8 +28,7 @@ export default async function handler(req, res) {
     }
 
     // Send request to FastAPI backend with orientation parameter
-    const backendUrl = process.env.BACKEND_URL || 'http://localhost:8000';
-    const response = await axios.post(`${backendUrl}/generate`, { 
+    const response = await backendClient.post('/generate', { 
       prompt,
       orientation
     });